@@ -0,0 +1,21 @@
+from django.contrib import admin
+
+from .aircraft_mod_models import AircraftBackgroundJobState
+
+
+@admin.register(AircraftBackgroundJobState)
+class AircraftBackgroundJobStateAdmin(admin.ModelAdmin):
+    """
+    Read-only status page of the background jobs, see run_background_jobs.py.
+    """
+    list_display = ('job', 'sorties_left', 'sorties_processed', 'batches', 'wall_seconds', 'db_seconds',
+                    'sorties_per_second', 'last_sorties_per_second', 'eta_seconds', 'last_batch_at')
+
+    def get_readonly_fields(self, request, obj=None):
+        return [field.name for field in self.model._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
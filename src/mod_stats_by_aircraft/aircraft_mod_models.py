@@ -1,10 +1,11 @@
 from django.db import models
-from stats.models import Tour, Object, Sortie, rating_format_helper, Player
+from stats.models import Tour, Object, Sortie, Mission, rating_format_helper, Player
 from mission_report.constants import Coalition
 from django.contrib.postgres.fields import JSONField
 from django.utils.translation import ugettext_lazy as _, pgettext_lazy
 from django.conf import settings
 from django.urls import reverse
+from django.utils import timezone
 
 from .reservoir_sampling import SAMPLE, RESERVOIR_COUNTER, update_reservoir
 from .variant_utils import has_bomb_variant, has_juiced_variant
@@ -175,12 +176,15 @@ class AircraftBucket(models.Model):
     # Ammo breakdowns recomputation to include more data.
     reset_ammo_breakdown = models.BooleanField(default=False, db_index=True)
     reset_ammo_breakdown_2 = models.BooleanField(default=False, db_index=True)
+    # Dito for the lethality counters, which turret kills were counted twice into.
+    reset_lethality = models.BooleanField(default=False, db_index=True)
     # ========================== NON-VISIBLE HELPER FIELDS  END
 
     class Meta:
         # The long table name is to avoid any conflicts with new tables defined in the main branch of IL2 Stats.
         db_table = "AircraftBucket_MOD_STATS_BY_AIRCRAFT"
         ordering = ['-id']
+        # The natural key is unique, by two partial unique indexes made in migration 0017. See db_utils.fetch_or_create.
 
     def update_derived_fields(self):
         ai_kills = 0
@@ -214,6 +218,7 @@ class AircraftBucket(models.Model):
         self.reset_elo = True
         self.reset_ammo_breakdown = True
         self.reset_ammo_breakdown_2 = True
+        self.reset_lethality = True
 
     def update_rating(self):
         if self.player is None:
@@ -632,6 +637,46 @@ class AircraftBucket(models.Model):
                     sub_dict[TOTALS][key][M2][ammo_key] / (sub_dict[TOTALS][key][INST] - 1),
                 ), 2)
 
+    def decrement_ammo_received(self, ammo_dict, pilot_snipe):
+        self.__decrement_helper(ammo_dict, self.ammo_breakdown[RECEIVED], pilot_snipe)
+
+    def decrement_ammo_given(self, ammo_dict, pilot_snipe):
+        self.__decrement_helper(ammo_dict, self.ammo_breakdown[GIVEN], pilot_snipe)
+
+    @staticmethod
+    def __decrement_helper(ammo_dict, sub_dict, pilot_snipe):
+        """
+        Inverse of __increment_helper, by running Welford's algorithm backwards.
+        The reservoir sample can't be reversed, it may still contain ammo_dict.
+        """
+        key = multi_key_to_string(list(ammo_dict.keys()))
+        if not key or key not in sub_dict[TOTALS]:
+            return
+
+        totals = sub_dict[TOTALS][key]
+        totals[INST] -= 1
+        totals[PILOT_KILLS] -= 1 if pilot_snipe else 0
+        if totals[INST] <= 0:
+            del sub_dict[TOTALS][key]
+            del sub_dict[AVERAGES][key]
+            return
+
+        for ammo_key in ammo_dict:
+            times_hit = ammo_dict[ammo_key]
+            old_mean = sub_dict[AVERAGES][key].get(ammo_key, 0)
+            totals[COUNT][ammo_key] -= times_hit
+            new_mean = compute_float(totals[COUNT][ammo_key], totals[INST])
+            sub_dict[AVERAGES][key][ammo_key] = new_mean
+
+            totals[M2][ammo_key] = max(totals[M2].get(ammo_key, 0) - (times_hit - old_mean) * (times_hit - new_mean),
+                                       0)
+            if totals[INST] > 1:
+                totals[STANDARD_DEVIATION][ammo_key] = round(math.sqrt(
+                    totals[M2][ammo_key] / (totals[INST] - 1),
+                ), 2)
+            else:
+                totals[STANDARD_DEVIATION].pop(ammo_key, None)
+
 
 def multi_key_to_string(keys, separator='|'):
     keys = sorted(keys)
@@ -708,11 +753,15 @@ class AircraftKillboard(models.Model):
     reset_kills_turret_bug = models.BooleanField(default=False, db_index=True)
     # This field is only relevant for killboards with Player.
     reset_player_loses = models.BooleanField(default=False, db_index=True)
+    # This field is only relevant for killboards without Player. See FixLethality.
+    reset_lethality = models.BooleanField(default=False, db_index=True)
 
     class Meta:
         # The long table name is to avoid any conflicts with new tables defined in the main branch of IL2 Stats.
         db_table = "AircraftKillboard_MOD_STATS_BY_AIRCRAFT"
         ordering = ['-id']
+        # Required by the upsert which adds killboard deltas onto the existing rows.
+        unique_together = (('aircraft_1', 'aircraft_2', 'tour'),)
 
     def get_aircraft_url(self, one_or_two):
         if one_or_two == 1:
@@ -735,8 +784,118 @@ class SortieAugmentation(models.Model):
     recomputed_ammo_breakdown = models.BooleanField(default=False, db_index=True)
     recomputed_ammo_breakdown_2 = models.BooleanField(default=False, db_index=True)
     fixed_captures = models.BooleanField(default=False, db_index=True)
-
+    fixed_lethality = models.BooleanField(default=False, db_index=True)
+    # Result of get_sortie_type, so that the payload of a sortie is parsed only once. Null if not classified yet.
+    filter_type = models.CharField(max_length=16, choices=AircraftBucket.filter_choices, null=True, default=None,
+                                   db_index=True)
 
     class Meta:
         # The long table name is to avoid any conflicts with new tables defined in the main branch of IL2 Stats.
         db_table = "Sortie_MOD_STATS_BY_AIRCRAFT"
+
+
+# Missions whose core stats are committed, but whose aircraft stats are not computed yet.
+class AircraftStatsQueue(models.Model):
+    mission = models.OneToOneField(Mission, on_delete=models.CASCADE, related_name='+')
+    enqueued_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = "AircraftStatsQueue_MOD_STATS_BY_AIRCRAFT"
+        ordering = ['id']
+
+
+# What the aircraft stats of a mission added onto the buckets and killboards, so that the mission can be retracted.
+# See contributions.py.
+class AircraftStatsContribution(models.Model):
+    mission = models.OneToOneField(Mission, on_delete=models.CASCADE, related_name='+')
+    # List of {'bucket': id, 'counters': {field: delta}, 'dict_counters': {field: {key: delta}}, 'elo': delta,
+    #          'ammo': [[RECEIVED or GIVEN, ammo_dict, pilot_snipe], ...]}
+    buckets = JSONField(default=list)
+    # List of [aircraft_1 id, aircraft_2 id, tour id, {field: delta}]
+    killboards = JSONField(default=list)
+    retracted = models.BooleanField(default=False)
+
+    class Meta:
+        db_table = "AircraftStatsContribution_MOD_STATS_BY_AIRCRAFT"
+
+
+# Which buckets were touched while processing a sortie, including the buckets of its enemies.
+# Used to find the sorties which have to be processed again when only some buckets are recomputed.
+class AircraftBucketMembership(models.Model):
+    sortie = models.ForeignKey(Sortie, on_delete=models.CASCADE, related_name='+', db_index=False)
+    bucket = models.ForeignKey(AircraftBucket, on_delete=models.CASCADE, related_name='+', db_index=True)
+
+    class Meta:
+        db_table = "AircraftBucketMembership_MOD_STATS_BY_AIRCRAFT"
+        unique_together = (('sortie', 'bucket'),)
+
+
+# Changes to a bucket without player, which are not yet folded into the bucket. Rows are only ever appended and
+# deleted, see bucket_delta_log.py.
+class AircraftBucketDelta(models.Model):
+    bucket = models.ForeignKey(AircraftBucket, on_delete=models.CASCADE, related_name='+', db_index=False)
+    # Same format as the entries of AircraftStatsContribution.buckets, plus the coalition of the bucket.
+    changes = JSONField()
+
+    class Meta:
+        db_table = "AircraftBucketDelta_MOD_STATS_BY_AIRCRAFT"
+
+
+# A range of sorties of one tour which a background job still has to process, claimed by the retro compute workers.
+# The chunks of a tour are processed one after the other, in the order of their ids. See retro_work_queue.py.
+class AircraftRetroChunk(models.Model):
+    tour = models.ForeignKey(Tour, related_name='+', on_delete=models.CASCADE, db_index=False)
+    # Class name of the BackgroundJob.
+    job = models.CharField(max_length=64)
+    first_sortie_id = models.IntegerField()
+    last_sortie_id = models.IntegerField()
+
+    class Meta:
+        db_table = "AircraftRetroChunk_MOD_STATS_BY_AIRCRAFT"
+        ordering = ['id']
+        index_together = (('tour', 'id'),)
+
+
+# Where a BackgroundJob left off in its pass over the sorties, so that each batch continues after the last one.
+# See run_background_jobs.py.
+class AircraftBackgroundJobState(models.Model):
+    # Class name of the BackgroundJob.
+    job = models.CharField(max_length=64, unique=True)
+    # The last sortie processed in the current pass, None at the start of a pass. Sorties are ordered by
+    # descending tour id, then ascending sortie id.
+    cursor_tour_id = models.IntegerField(null=True)
+    cursor_sortie_id = models.IntegerField(null=True)
+    # Sorties left in the current pass. Counted at the start of a pass, and decremented with every batch.
+    sorties_left = models.IntegerField(null=True)
+
+    # Telemetry, summed up over all batches. See record_batch.
+    batches = models.IntegerField(default=0)
+    sorties_processed = models.BigIntegerField(default=0)
+    wall_seconds = models.FloatField(default=0)
+    # The part of wall_seconds not spent on the CPU of the stats process, i.e. mostly waiting on the database.
+    db_seconds = models.FloatField(default=0)
+    last_sorties_per_second = models.FloatField(null=True)
+    last_batch_at = models.DateTimeField(null=True)
+
+    class Meta:
+        db_table = "AircraftBackgroundJobState_MOD_STATS_BY_AIRCRAFT"
+        ordering = ['id']
+
+    def record_batch(self, nr_sorties, wall_seconds, cpu_seconds):
+        self.batches += 1
+        self.sorties_processed += nr_sorties
+        self.wall_seconds += wall_seconds
+        self.db_seconds += max(0, wall_seconds - cpu_seconds)
+        self.last_sorties_per_second = nr_sorties / max(wall_seconds, 0.001)
+        self.last_batch_at = timezone.now()
+
+    def sorties_per_second(self):
+        return self.sorties_processed / self.wall_seconds if self.wall_seconds else None
+
+    def eta_seconds(self):
+        """
+        @returns Estimated seconds until the current pass is done, at the speed of the last batch. None if unknown.
+        """
+        if self.sorties_left is None or not self.last_sorties_per_second:
+            return None
+        return self.sorties_left / self.last_sorties_per_second
@@ -39,3 +39,6 @@ class ModConfig(AppConfig):
         import config
 
         config.DEFAULT['stats']['retro_compute_for_last_tours'] = 10
+        config.DEFAULT['stats']['aircraft_stats_processes'] = 1
+        config.DEFAULT['stats']['aircraft_stats_compact_interval'] = 0
+        config.DEFAULT['stats']['background_jobs_time_budget'] = 2
@@ -2,6 +2,11 @@ from django.core.exceptions import FieldError
 from django.db import ProgrammingError
 from stats.models import Tour, Sortie
 from django.db.models import Max
+from ..aircraft_mod_models import AircraftBucket
+from ..db_utils import bulk_update, update_increment
+from ..sortie_loader import iterate_sorties
+from ..unit_of_work import StatsUnitOfWork, BUCKET_NATURAL_KEY, BUCKET_UPDATE_FIELDS
+from ..variant_utils import get_sortie_type
 import config
 
 RETRO_COMPUTE_FOR_LAST_TOURS = config.get_conf()['stats'].getint('retro_compute_for_last_tours')
@@ -17,7 +22,58 @@ def get_tour_cutoff():
     return max_id - RETRO_COMPUTE_FOR_LAST_TOURS
 
 
+def compute_in_batch(sorties, compute):
+    """
+    Calls compute(sortie, uow) on each of the sorties, with one StatsUnitOfWork for the whole batch. It is bulk loaded
+    with COPY on flush.
+
+    @param sorties Sliced QuerySet with the next batch of sorties.
+    """
+    sorties = list(iterate_sorties(sorties))
+    uow = StatsUnitOfWork(bulk_load=True)
+    uow.prefetch_buckets(sorties)
+    for sortie in sorties:
+        compute(sortie, uow)
+        # Keeps the Elo of the sorties in the order in which they are processed one by one.
+        uow.elo_batch.apply()
+    uow.flush()
+
+
+def sortie_bucket_keys(sortie):
+    """
+    @returns Natural keys (tour id, aircraft id, filter type, player id) of the up to four buckets the sortie counts
+             towards.
+    """
+    filter_types = ['NO_FILTER']
+    if get_sortie_type(sortie) != 'NO_FILTER':
+        filter_types.append(get_sortie_type(sortie))
+    return [(sortie.tour_id, sortie.aircraft_id, filter_type, player_id)
+            for filter_type in filter_types for player_id in (None, sortie.player_id)]
+
+
+def increment_buckets(fields, deltas):
+    """
+    Adds the deltas onto the buckets with one UPDATE, then updates the derived fields of these buckets.
+
+    @param fields Names of the counter fields which are incremented.
+    @param deltas Dict from bucket natural key, see sortie_bucket_keys, to a dict {field: delta}.
+    """
+    bucket_ids = update_increment(AircraftBucket, BUCKET_NATURAL_KEY, fields,
+                                  [key + tuple(counters.get(field, 0) for field in fields)
+                                   for key, counters in deltas.items()])
+    # The rows stay locked by the UPDATE until the commit, so writing back all fields loses no concurrent update.
+    buckets = list(AircraftBucket.objects.select_related('tour', 'aircraft', 'player')
+                   .filter(id__in=bucket_ids).order_by('id'))
+    for bucket in buckets:
+        bucket.update_derived_fields()
+    bulk_update(AircraftBucket, buckets, BUCKET_UPDATE_FIELDS)
+
+
 class BackgroundJob:
+    # Whether compute_for_sorties handles a batch with a few set-based statements, instead of computing each sortie.
+    # Such jobs are not fused, see FusedBackgroundJob, and get larger batches.
+    set_based = False
+
     def __init__(self):
         tour_cutoff = get_tour_cutoff()
         try:
@@ -43,10 +99,32 @@ class BackgroundJob:
 
         @param tour_cutoff The first tour that should be searched.
         @returns A django QuerySet which will find all the Sorties which need to be processed for this job.
+                 Wrapped in sortie_loader.lean_sorties, so that the relations the job reads are loaded along.
         """
         print("[mod_stats_by_aircraft]: WARNING: Programing Error unimplemented background job query find.")
         return Sortie.objects.none()
 
+    def pending_sorties(self):
+        """
+        Optional method, for jobs which can run as part of a FusedBackgroundJob.
+
+        @returns Q object which finds the sorties this job still has to process, without the tour cutoff.
+                 None if the job can't be fused.
+        """
+        return None
+
+    def compute_in_unit_of_work(self, sortie, uow):
+        """
+        Optional method, for jobs which implement pending_sorties.
+
+        Same as compute_for_sortie, but all changes, including the SortieAugmentation flags, are made in uow. The caller
+        flushes it, possibly after other sorties and jobs made their changes in it too.
+
+        @param sortie Sortie found by pending_sorties.
+        @param uow StatsUnitOfWork, see unit_of_work.py.
+        """
+        print("[mod_stats_by_aircraft]: WARNING: Programing Error unimplemented background job unit of work.")
+
     def compute_for_sortie(self, sortie):
         """
         Does the necessary computations on a single sortie found by query_find_sorties.
@@ -55,6 +133,18 @@ class BackgroundJob:
         """
         print("[mod_stats_by_aircraft]: WARNING: Programing Error unimplemented background job one sortie.")
 
+    def compute_for_sorties(self, sorties):
+        """
+        Optional method.
+
+        Does the necessary computations on a batch of sorties found by query_find_sorties. Jobs which can handle a
+        whole batch at once, e.g. with a few bulk updates, override this. By default calls compute_for_sortie on each.
+
+        @param sorties Sliced QuerySet with the next batch of sorties.
+        """
+        for sortie in iterate_sorties(sorties):
+            self.compute_for_sortie(sortie)
+
     def log_update(self, to_compute):
         """
         Message which shows a status update on how many sorties left to compute for this job.
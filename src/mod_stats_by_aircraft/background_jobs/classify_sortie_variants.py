@@ -0,0 +1,48 @@
+from collections import defaultdict
+
+from .background_job import BackgroundJob
+from stats.models import Sortie
+from ..aircraft_mod_models import SortieAugmentation
+from ..variant_utils import classify_sortie
+from ..sortie_loader import lean_sorties, iterate_sorties
+from django.db.models import Q
+
+
+class ClassifySortieVariants(BackgroundJob):
+    """
+    SortieAugmentation.filter_type was introduced in 1.6.0. It stores the result of get_sortie_type, so that the
+    modifications and payload of a sortie are not parsed again every time the sortie is looked at.
+
+    This job classifies the already processed sorties. A whole batch is written with one UPDATE per filter type.
+    """
+
+    def pending_sorties(self):
+        return Q(SortieAugmentation_MOD_STATS_BY_AIRCRAFT__isnull=False,
+                 SortieAugmentation_MOD_STATS_BY_AIRCRAFT__filter_type__isnull=True)
+
+    def query_find_sorties(self, tour_cutoff):
+        return lean_sorties(
+            Sortie.objects.filter(self.pending_sorties(), aircraft__cls_base='aircraft', tour__id__gte=tour_cutoff)
+            .order_by('-tour__id', 'id'))
+
+    def compute_for_sorties(self, sorties):
+        sortie_ids_by_type = defaultdict(list)
+        for sortie in iterate_sorties(sorties):
+            sortie_ids_by_type[classify_sortie(sortie)].append(sortie.id)
+
+        for filter_type, sortie_ids in sortie_ids_by_type.items():
+            SortieAugmentation.objects.filter(sortie_id__in=sortie_ids).update(filter_type=filter_type)
+
+    def compute_in_unit_of_work(self, sortie, uow):
+        # Stores the filter type of the sortie, without setting any flag.
+        uow.mark_sortie(sortie)
+
+    def compute_for_sortie(self, sortie):
+        SortieAugmentation.objects.filter(sortie_id=sortie.id).update(filter_type=classify_sortie(sortie))
+
+    def log_update(self, to_compute):
+        return '[mod_stats_by_aircraft]: Classifying sortie variants. {} sorties left to process.' \
+            .format(to_compute)
+
+    def log_done(self):
+        return '[mod_stats_by_aircraft]: Completed classifying sortie variants.'
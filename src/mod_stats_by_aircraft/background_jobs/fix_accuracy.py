@@ -1,7 +1,14 @@
-from .background_job import BackgroundJob
-from stats.models import Sortie
-from ..aircraft_mod_models import AircraftBucket
-from ..aircraft_stats_compute import decrement_ammo_bugged, get_sortie_type
+from collections import defaultdict
+
+from .background_job import BackgroundJob, sortie_bucket_keys, increment_buckets
+from stats.models import Sortie, LogEntry
+from ..aircraft_mod_models import SortieAugmentation
+from ..aircraft_stats_compute import decrement_ammo_bugged, get_sortie_type, bugged_ammo_counters, BUGGED_AMMO_COUNTERS
+from ..event_index import MissionEventIndex
+from ..unit_of_work import unit_of_work
+from ..sortie_loader import lean_sorties, iterate_sorties
+from django.db.models import Q, Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 
 
 class FixAccuracy(BackgroundJob):
@@ -9,34 +16,54 @@ class FixAccuracy(BackgroundJob):
     Versions before 1.3.0 counted all bullet/bomb/rocket hits and misses towards stats from all sorties. This was
     incorrect behaviour, since game logs contain bugs in certain cases.
 
-    This job goes through all the sorties that were processed, and decrements the broken sorties.
+    This job goes through all the sorties that were processed, and decrements the broken sorties. A whole batch is
+    subtracted with one UPDATE of the buckets, see compute_for_sorties.
     """
+    set_based = True
+
+    def pending_sorties(self):
+        return Q(SortieAugmentation_MOD_STATS_BY_AIRCRAFT__fixed_accuracy=False)
 
     def query_find_sorties(self, tour_cutoff):
-        return (Sortie.objects.filter(SortieAugmentation_MOD_STATS_BY_AIRCRAFT__fixed_accuracy=False,
-                                      aircraft__cls_base='aircraft', tour__id__gte=tour_cutoff)
-                .order_by('-tour__id'))
+        return lean_sorties(
+            Sortie.objects.filter(self.pending_sorties(), aircraft__cls_base='aircraft', tour__id__gte=tour_cutoff)
+            .order_by('-tour__id'))
 
-    def compute_for_sortie(self, sortie):
+    def compute_in_unit_of_work(self, sortie, uow):
         # TODO: Refactor this "get all buckets code" into a util function.
-        buckets = [(AircraftBucket.objects.get_or_create(tour=sortie.tour, aircraft=sortie.aircraft,
-                                                         filter_type='NO_FILTER', player=None))[0],
-                   (AircraftBucket.objects.get_or_create(tour=sortie.tour, aircraft=sortie.aircraft,
-                                                         filter_type='NO_FILTER', player=sortie.player))[0]]
+        buckets = [uow.bucket(sortie.tour, sortie.aircraft, 'NO_FILTER', None),
+                   uow.bucket(sortie.tour, sortie.aircraft, 'NO_FILTER', sortie.player)]
         filter_type = get_sortie_type(sortie)
         if filter_type != 'NO_FILTER':
-            buckets.append((AircraftBucket.objects.get_or_create(tour=sortie.tour, aircraft=sortie.aircraft,
-                                                                 filter_type=filter_type, player=None))[0])
-            buckets.append((AircraftBucket.objects.get_or_create(tour=sortie.tour, aircraft=sortie.aircraft,
-                                                                 filter_type=filter_type, player=sortie.player))[0])
+            buckets.append(uow.bucket(sortie.tour, sortie.aircraft, filter_type, None))
+            buckets.append(uow.bucket(sortie.tour, sortie.aircraft, filter_type, sortie.player))
 
+        event_index = MissionEventIndex.for_sortie(sortie)
         for bucket in buckets:
-            decrement_ammo_bugged(bucket, sortie)
-            bucket.update_derived_fields()
-            bucket.save()
+            decrement_ammo_bugged(bucket, sortie, event_index)
+
+        uow.mark_sortie(sortie, 'fixed_accuracy')
 
-        sortie.SortieAugmentation_MOD_STATS_BY_AIRCRAFT.fixed_accuracy = True
-        sortie.SortieAugmentation_MOD_STATS_BY_AIRCRAFT.save()
+    def compute_for_sorties(self, sorties):
+        sortie_ids = sorties.values('id')
+        takeoff_counts = (LogEntry.objects.filter(act_sortie_id=OuterRef('id'), type='takeoff').order_by()
+                          .values('act_sortie_id').annotate(count=Count('id')).values('count'))
+        # Only the few sorties which bugged_ammo_counters doesn't skip are loaded.
+        broken_sorties = (Sortie.objects.filter(id__in=sortie_ids)
+                          .annotate(takeoff_count=Coalesce(Subquery(takeoff_counts, output_field=IntegerField()), 0))
+                          .filter(Q(is_bailout=True) | Q(takeoff_count__gt=1)))
+        deltas = defaultdict(dict)
+        for sortie in iterate_sorties(lean_sorties(broken_sorties)):
+            for field, value in bugged_ammo_counters(sortie, sortie.takeoff_count).items():
+                for key in sortie_bucket_keys(sortie):
+                    deltas[key][field] = deltas[key].get(field, 0) - value
+
+        increment_buckets(list(BUGGED_AMMO_COUNTERS), deltas)
+        SortieAugmentation.objects.filter(sortie_id__in=sortie_ids).update(fixed_accuracy=True)
+
+    def compute_for_sortie(self, sortie):
+        with unit_of_work() as uow:
+            self.compute_in_unit_of_work(sortie, uow)
 
     def log_update(self, to_compute):
         return '[mod_stats_by_aircraft]: Fixing accuracy stats. {} sorties left to process.' .format(to_compute)
@@ -1,7 +1,12 @@
-from .background_job import BackgroundJob
+from collections import defaultdict
+
+from .background_job import BackgroundJob, sortie_bucket_keys, increment_buckets
 from stats.models import Sortie
-from ..aircraft_mod_models import AircraftBucket
+from ..aircraft_mod_models import SortieAugmentation
 from ..aircraft_stats_compute import get_sortie_type
+from ..unit_of_work import unit_of_work
+from ..sortie_loader import lean_sorties, iterate_sorties
+from django.db.models import Q
 from django.db.utils import DatabaseError
 
 
@@ -10,39 +15,54 @@ class FixCaptures(BackgroundJob):
     All versions before 1.5.1 counted a sortie with a capture + death as both a capture and death,
     when it should have been counted only as a death.
 
-    This job goes through all the sorties that were processed, and decrements the broken sorties.
+    This job goes through all the sorties that were processed, and decrements the broken sorties. A whole batch is
+    subtracted with one UPDATE of the buckets, see compute_for_sorties.
     """
+    set_based = True
+
+    def pending_sorties(self):
+        return Q(SortieAugmentation_MOD_STATS_BY_AIRCRAFT__fixed_captures=False)
 
     def query_find_sorties(self, tour_cutoff):
-        return (Sortie.objects.filter(SortieAugmentation_MOD_STATS_BY_AIRCRAFT__fixed_captures=False,
-                                      aircraft__cls_base='aircraft', tour__id__gte=tour_cutoff)
-                .order_by('-tour__id'))
+        return lean_sorties(
+            Sortie.objects.filter(self.pending_sorties(), aircraft__cls_base='aircraft', tour__id__gte=tour_cutoff)
+            .order_by('-tour__id'))
+
+    def compute_in_unit_of_work(self, sortie, uow):
+        if sortie.is_captured and sortie.is_dead:
+            # TODO: Refactor this "get all buckets code" into a util function.
+            buckets = [uow.bucket(sortie.tour, sortie.aircraft, 'NO_FILTER', None),
+                       uow.bucket(sortie.tour, sortie.aircraft, 'NO_FILTER', sortie.player)]
+            filter_type = get_sortie_type(sortie)
+            if filter_type != 'NO_FILTER':
+                buckets.append(uow.bucket(sortie.tour, sortie.aircraft, filter_type, None))
+                buckets.append(uow.bucket(sortie.tour, sortie.aircraft, filter_type, sortie.player))
+
+            for bucket in buckets:
+                bucket.captures -= 1
+
+        uow.mark_sortie(sortie, 'fixed_captures')
+
+    def compute_for_sorties(self, sorties):
+        sortie_ids = sorties.values('id')
+        deltas = defaultdict(dict)
+        # Only the few captured sorties are loaded, since is_dead is worked out by Sortie.
+        for sortie in iterate_sorties(lean_sorties(Sortie.objects.filter(id__in=sortie_ids, is_captured=True))):
+            if sortie.is_dead:
+                for key in sortie_bucket_keys(sortie):
+                    deltas[key]['captures'] = deltas[key].get('captures', 0) - 1
+
+        increment_buckets(['captures'], deltas)
+        SortieAugmentation.objects.filter(sortie_id__in=sortie_ids).update(fixed_captures=True)
 
     def compute_for_sortie(self, sortie):
         try:
-            if sortie.is_captured and sortie.is_dead:
-                # TODO: Refactor this "get all buckets code" into a util function.
-                buckets = [(AircraftBucket.objects.get_or_create(tour=sortie.tour, aircraft=sortie.aircraft,
-                                                                 filter_type='NO_FILTER', player=None))[0],
-                           (AircraftBucket.objects.get_or_create(tour=sortie.tour, aircraft=sortie.aircraft,
-                                                                 filter_type='NO_FILTER', player=sortie.player))[0]]
-                filter_type = get_sortie_type(sortie)
-                if filter_type != 'NO_FILTER':
-                    buckets.append((AircraftBucket.objects.get_or_create(tour=sortie.tour, aircraft=sortie.aircraft,
-                                                                         filter_type=filter_type, player=None))[0])
-                    buckets.append((AircraftBucket.objects.get_or_create(tour=sortie.tour, aircraft=sortie.aircraft,
-                                                                         filter_type=filter_type,
-                                                                         player=sortie.player))[0])
-
-                for bucket in buckets:
-                    bucket.captures -= 1
-                    bucket.update_derived_fields()
-                    bucket.save()
+            with unit_of_work() as uow:
+                self.compute_in_unit_of_work(sortie, uow)
         except DatabaseError:
-            pass # Just ignore the sortie if it fails for some reason. Old data - not too important.
-
-        sortie.SortieAugmentation_MOD_STATS_BY_AIRCRAFT.fixed_captures = True
-        sortie.SortieAugmentation_MOD_STATS_BY_AIRCRAFT.save()
+            # Just ignore the sortie if it fails for some reason. Old data - not too important.
+            sortie.SortieAugmentation_MOD_STATS_BY_AIRCRAFT.fixed_captures = True
+            sortie.SortieAugmentation_MOD_STATS_BY_AIRCRAFT.save()
 
     def log_update(self, to_compute):
         return '[mod_stats_by_aircraft]: Fixing capture stats. {} sorties left to process.'.format(to_compute)
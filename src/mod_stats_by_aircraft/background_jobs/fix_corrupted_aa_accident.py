@@ -2,6 +2,10 @@ from .background_job import BackgroundJob
 from stats.models import Sortie
 from ..aircraft_mod_models import AircraftBucket
 from ..aircraft_stats_compute import process_aa_accident_death, get_sortie_type
+from ..event_index import MissionEventIndex
+from ..unit_of_work import unit_of_work
+from ..sortie_loader import lean_sorties
+from django.db.models import Q
 
 
 class FixCorruptedAaAccidents(BackgroundJob):
@@ -21,29 +25,30 @@ class FixCorruptedAaAccidents(BackgroundJob):
             reset_accident_aa_stats=True
         )
 
+    def pending_sorties(self):
+        return Q(SortieAugmentation_MOD_STATS_BY_AIRCRAFT__fixed_aa_accident_stats=False)
+
     def query_find_sorties(self, tour_cutoff):
-        return (Sortie.objects.filter(SortieAugmentation_MOD_STATS_BY_AIRCRAFT__fixed_aa_accident_stats=False,
-                                      aircraft__cls_base='aircraft', tour__id__gte=tour_cutoff)
-                .order_by('-tour__id'))
+        return lean_sorties(
+            Sortie.objects.filter(self.pending_sorties(), aircraft__cls_base='aircraft', tour__id__gte=tour_cutoff)
+            .order_by('-tour__id'))
 
-    def compute_for_sortie(self, sortie):
-        buckets = [(AircraftBucket.objects.get_or_create(tour=sortie.tour, aircraft=sortie.aircraft,
-                                                         filter_type='NO_FILTER', player=None))[0],
-                   (AircraftBucket.objects.get_or_create(tour=sortie.tour, aircraft=sortie.aircraft,
-                                                         filter_type='NO_FILTER', player=sortie.player))[0]]
+    def compute_in_unit_of_work(self, sortie, uow):
+        buckets = [uow.bucket(sortie.tour, sortie.aircraft, 'NO_FILTER', None),
+                   uow.bucket(sortie.tour, sortie.aircraft, 'NO_FILTER', sortie.player)]
         filter_type = get_sortie_type(sortie)
         if filter_type != 'NO_FILTER':
-            buckets.append((AircraftBucket.objects.get_or_create(tour=sortie.tour, aircraft=sortie.aircraft,
-                                                                 filter_type=filter_type, player=None))[0])
-            buckets.append((AircraftBucket.objects.get_or_create(tour=sortie.tour, aircraft=sortie.aircraft,
-                                                                 filter_type=filter_type, player=sortie.player))[0])
+            buckets.append(uow.bucket(sortie.tour, sortie.aircraft, filter_type, None))
+            buckets.append(uow.bucket(sortie.tour, sortie.aircraft, filter_type, sortie.player))
+        event_index = MissionEventIndex.for_sortie(sortie)
         for bucket in buckets:
-            process_aa_accident_death(bucket, sortie)
-            bucket.update_derived_fields()
-            bucket.save()
+            process_aa_accident_death(bucket, sortie, event_index)
 
-        sortie.SortieAugmentation_MOD_STATS_BY_AIRCRAFT.fixed_aa_accident_stats = True
-        sortie.SortieAugmentation_MOD_STATS_BY_AIRCRAFT.save()
+        uow.mark_sortie(sortie, 'fixed_aa_accident_stats')
+
+    def compute_for_sortie(self, sortie):
+        with unit_of_work() as uow:
+            self.compute_in_unit_of_work(sortie, uow)
 
     def log_update(self, to_compute):
         return '[mod_stats_by_aircraft]: Fixing AA/Accidents aircraft lost/deaths stats. {} sorties left to process.' \
@@ -0,0 +1,76 @@
+from .background_job import BackgroundJob
+from stats.models import Sortie
+from ..aircraft_mod_models import AircraftBucket, AircraftKillboard
+from ..bucket_delta_log import compact_all_bucket_deltas
+from ..sortie_loader import lean_sorties
+from django.db.models import Q
+
+
+class FixLethality(BackgroundJob):
+    """
+    All versions before 1.6.0 had two bugs in the stats of the buckets without Player:
+
+    - The turret loop in process_log_entries shadowed the primary bucket with an enemy bucket. So the turrets after
+      the first one which shot down the sortie counted their kills, Elo and lethality into the turret buckets twice.
+    - plane_lethality_counter was incremented even when the primary bucket was not to be updated, so the retroactive
+      player stats compute counted it once more.
+
+    This job resets the Elos, lethalities and killboards without Player, like FixTurretKillboards, and recomputes them.
+    The killboards of the player buckets against turrets keep the kills the shadowing left out.
+    """
+
+    def reset_relevant_fields(self, tour_cutoff):
+        # Otherwise the pending deltas would be folded into the buckets after they were reset.
+        compact_all_bucket_deltas()
+        AircraftBucket.objects.filter(player=None, reset_lethality=False, tour__id__gte=tour_cutoff).update(
+            elo=1500,
+            pilot_kills=0,
+            distinct_enemies_hit=0,
+            plane_lethality_counter=0,
+            pilot_lethality_counter=0,
+            reset_lethality=True)
+        AircraftKillboard.objects.filter(
+            aircraft_1__player=None,
+            aircraft_2__player=None,
+            reset_lethality=False,
+            tour__id__gte=tour_cutoff).delete()
+
+    def pending_sorties(self):
+        # Sorties which were not processed yet get the fixed stats from the retroactive compute.
+        return Q(SortieAugmentation_MOD_STATS_BY_AIRCRAFT__sortie_stats_processed=True,
+                 SortieAugmentation_MOD_STATS_BY_AIRCRAFT__fixed_lethality=False)
+
+    def query_find_sorties(self, tour_cutoff):
+        return lean_sorties(
+            Sortie.objects.filter(self.pending_sorties(), aircraft__cls_base='aircraft', tour__id__gte=tour_cutoff)
+            .order_by('-tour__id', 'id'))
+
+    def compute_in_unit_of_work(self, sortie, uow):
+        from ..aircraft_stats_compute import process_log_entries, get_sortie_type
+        from ..event_index import MissionEventIndex
+
+        buckets = [uow.bucket(sortie.tour, sortie.aircraft, 'NO_FILTER', None)]
+        filter_type = get_sortie_type(sortie)
+        has_subtype = filter_type != 'NO_FILTER'
+        if has_subtype:
+            buckets.append(uow.bucket(sortie.tour, sortie.aircraft, filter_type, None))
+        event_index = MissionEventIndex.for_sortie(sortie)
+        for bucket in buckets:
+            process_log_entries(bucket, sortie, has_subtype, bucket.filter_type != 'NO_FILTER',
+                                compute_only_pure_killboard_stats=True,
+                                do_not_use_pilot_kbs=True, event_index=event_index, uow=uow)
+
+        uow.mark_sortie(sortie, 'fixed_lethality')
+
+    def compute_for_sortie(self, sortie):
+        from ..unit_of_work import unit_of_work
+
+        with unit_of_work() as uow:
+            self.compute_in_unit_of_work(sortie, uow)
+
+    def log_update(self, to_compute):
+        return '[mod_stats_by_aircraft]: Fixing Elo and lethality of turret kills. {} sorties left to process.' \
+            .format(to_compute)
+
+    def log_done(self):
+        return '[mod_stats_by_aircraft]: Completed fixing Elo and lethality of turret kills.'
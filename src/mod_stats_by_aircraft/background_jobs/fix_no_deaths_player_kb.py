@@ -1,7 +1,11 @@
 from .background_job import BackgroundJob
 from stats.models import Sortie
-from ..aircraft_mod_models import AircraftBucket, AircraftKillboard
+from ..aircraft_mod_models import AircraftKillboard
 from ..aircraft_stats_compute import process_log_entries, get_sortie_type
+from ..event_index import MissionEventIndex
+from ..unit_of_work import unit_of_work
+from ..sortie_loader import lean_sorties
+from django.db.models import Q
 
 
 class FixNoDeathsPlayerKB(BackgroundJob):
@@ -40,26 +44,32 @@ class FixNoDeathsPlayerKB(BackgroundJob):
             reset_player_loses=True
         )
 
+    def pending_sorties(self):
+        return Q(SortieAugmentation_MOD_STATS_BY_AIRCRAFT__added_player_kb_losses=False)
+
     def query_find_sorties(self, tour_cutoff):
-        return (Sortie.objects.filter(SortieAugmentation_MOD_STATS_BY_AIRCRAFT__added_player_kb_losses=False,
-                                      aircraft__cls_base='aircraft', tour__id__gte=tour_cutoff)
-                .order_by('-tour__id'))
+        return lean_sorties(
+            Sortie.objects.filter(self.pending_sorties(), aircraft__cls_base='aircraft', tour__id__gte=tour_cutoff)
+            .order_by('-tour__id'))
 
-    def compute_for_sortie(self, sortie):
-        buckets = [(AircraftBucket.objects.get_or_create(tour=sortie.tour, aircraft=sortie.aircraft,
-                                                         filter_type='NO_FILTER', player=None))[0]]
+    def compute_in_unit_of_work(self, sortie, uow):
+        buckets = [uow.bucket(sortie.tour, sortie.aircraft, 'NO_FILTER', None)]
         filter_type = get_sortie_type(sortie)
         has_subtype = filter_type != 'NO_FILTER'
         if has_subtype:
-            buckets.append((AircraftBucket.objects.get_or_create(tour=sortie.tour, aircraft=sortie.aircraft,
-                                                                 filter_type=filter_type, player=None))[0])
+            buckets.append(uow.bucket(sortie.tour, sortie.aircraft, filter_type, None))
 
+        event_index = MissionEventIndex.for_sortie(sortie)
         for bucket in buckets:
             process_log_entries(bucket, sortie, has_subtype, bucket.filter_type != 'NO_FILTER',
-                                compute_only_pure_killboard_stats=True, stop_update_primary_bucket=True)
+                                compute_only_pure_killboard_stats=True, stop_update_primary_bucket=True,
+                                event_index=event_index, uow=uow)
 
-        sortie.SortieAugmentation_MOD_STATS_BY_AIRCRAFT.added_player_kb_losses = True
-        sortie.SortieAugmentation_MOD_STATS_BY_AIRCRAFT.save()
+        uow.mark_sortie(sortie, 'added_player_kb_losses')
+
+    def compute_for_sortie(self, sortie):
+        with unit_of_work() as uow:
+            self.compute_in_unit_of_work(sortie, uow)
 
     def log_update(self, to_compute):
         return '[mod_stats_by_aircraft]: Adding loses in player aircraft killboards {} sorties left to process.' \
@@ -1,6 +1,8 @@
 from .background_job import BackgroundJob
 from stats.models import Sortie
 from ..aircraft_mod_models import AircraftBucket, AircraftKillboard
+from ..sortie_loader import lean_sorties
+from django.db.models import Q
 
 
 class FixTurretKillboards(BackgroundJob):
@@ -24,28 +26,36 @@ class FixTurretKillboards(BackgroundJob):
             aircraft_2__player=None,
             reset_kills_turret_bug=False).delete()
 
+    def pending_sorties(self):
+        return Q(SortieAugmentation_MOD_STATS_BY_AIRCRAFT__fixed_doubled_turret_killboards=False)
+
     def query_find_sorties(self, tour_cutoff):
-        return (Sortie.objects.filter(SortieAugmentation_MOD_STATS_BY_AIRCRAFT__fixed_doubled_turret_killboards=False,
-                                      aircraft__cls_base='aircraft', tour__id__gte=tour_cutoff)
-                .order_by('-tour__id', 'id'))
+        return lean_sorties(
+            Sortie.objects.filter(self.pending_sorties(), aircraft__cls_base='aircraft', tour__id__gte=tour_cutoff)
+            .order_by('-tour__id', 'id'))
 
-    def compute_for_sortie(self, sortie):
+    def compute_in_unit_of_work(self, sortie, uow):
         from ..aircraft_stats_compute import process_log_entries, get_sortie_type
+        from ..event_index import MissionEventIndex
 
-        buckets = [(AircraftBucket.objects.get_or_create(tour=sortie.tour, aircraft=sortie.aircraft,
-                                                         filter_type='NO_FILTER', player=None))[0]]
+        buckets = [uow.bucket(sortie.tour, sortie.aircraft, 'NO_FILTER', None)]
         filter_type = get_sortie_type(sortie)
         has_subtype = filter_type != 'NO_FILTER'
         if has_subtype:
-            buckets.append((AircraftBucket.objects.get_or_create(tour=sortie.tour, aircraft=sortie.aircraft,
-                                                                 filter_type=filter_type, player=None))[0])
+            buckets.append(uow.bucket(sortie.tour, sortie.aircraft, filter_type, None))
+        event_index = MissionEventIndex.for_sortie(sortie)
         for bucket in buckets:
             process_log_entries(bucket, sortie, has_subtype, bucket.filter_type != 'NO_FILTER',
                                 compute_only_pure_killboard_stats=True,
-                                do_not_use_pilot_kbs=True)
+                                do_not_use_pilot_kbs=True, event_index=event_index, uow=uow)
+
+        uow.mark_sortie(sortie, 'fixed_doubled_turret_killboards')
+
+    def compute_for_sortie(self, sortie):
+        from ..unit_of_work import unit_of_work
 
-        sortie.SortieAugmentation_MOD_STATS_BY_AIRCRAFT.fixed_doubled_turret_killboards = True
-        sortie.SortieAugmentation_MOD_STATS_BY_AIRCRAFT.save()
+        with unit_of_work() as uow:
+            self.compute_in_unit_of_work(sortie, uow)
 
     def log_update(self, to_compute):
         return '[mod_stats_by_aircraft]: Fixing Elo and doubled killboard turret kills. {} sorties left to process.' \
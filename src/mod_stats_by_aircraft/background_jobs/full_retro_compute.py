@@ -1,6 +1,12 @@
-from .background_job import BackgroundJob
+from django.db.models import Q
+
+from .background_job import BackgroundJob, compute_in_batch
 from stats.models import Sortie
-from ..aircraft_stats_compute import process_aircraft_stats
+from ..aircraft_mod_models import AircraftStatsQueue
+from ..aircraft_stats_compute import process_all_aircraft_stats
+from ..event_index import MissionEventIndex
+from ..unit_of_work import unit_of_work
+from ..sortie_loader import lean_sorties
 
 
 class FullRetroCompute(BackgroundJob):
@@ -10,14 +16,26 @@ class FullRetroCompute(BackgroundJob):
     stored Sortie objects.
     """
 
+    def pending_sorties(self):
+        # Queued missions are left to process_aircraft_stats_queue.
+        return (Q(SortieAugmentation_MOD_STATS_BY_AIRCRAFT__isnull=True) &
+                ~Q(mission_id__in=AircraftStatsQueue.objects.values('mission_id')))
+
     def query_find_sorties(self, tour_cutoff):
-        return (Sortie.objects.filter(SortieAugmentation_MOD_STATS_BY_AIRCRAFT__isnull=True,
-                                      aircraft__cls_base='aircraft', tour__id__gte=tour_cutoff)
-                .order_by('-tour__id', 'id'))
+        return lean_sorties(
+            Sortie.objects.filter(self.pending_sorties(), aircraft__cls_base='aircraft', tour__id__gte=tour_cutoff)
+            .order_by('-tour__id', 'id'))
+
+    def compute_in_unit_of_work(self, sortie, uow):
+        event_index = MissionEventIndex.for_sortie(sortie)
+        process_all_aircraft_stats(sortie, is_retro_compute=True, event_index=event_index, uow=uow)
 
     def compute_for_sortie(self, sortie):
-        process_aircraft_stats(sortie, is_retro_compute=True)
-        process_aircraft_stats(sortie, sortie.player, is_retro_compute=True)
+        with unit_of_work() as uow:
+            self.compute_in_unit_of_work(sortie, uow)
+
+    def compute_for_sorties(self, sorties):
+        compute_in_batch(sorties, self.compute_in_unit_of_work)
 
     def log_update(self, to_compute):
         return '[mod_stats_by_aircraft]: Retroactively computing aircraft stats. {} sorties left to process.' \
@@ -0,0 +1,67 @@
+from functools import reduce
+import operator
+
+from django.db.models import BooleanField, Case, Value, When
+
+from .background_job import BackgroundJob, compute_in_batch
+from stats.models import Sortie
+from ..sortie_loader import lean_sorties
+
+
+class FusedBackgroundJob(BackgroundJob):
+    """
+    Runs all jobs which implement pending_sorties in a single pass over the sorties.
+
+    After an update across several versions of this mod, many jobs have work left on the same sorties. Each of them
+    would search and load the sorties, and fetch their buckets, on its own. This job loads every sortie which some job
+    still has to process once, along with which jobs do, and lets each of these jobs compute it. The whole batch shares
+    one unit of work, which is flushed once.
+
+    The other jobs are still run on their own by run_background_jobs afterwards. They find no sorties left then.
+    """
+
+    def __init__(self, jobs):
+        # The list is shared with run_background_jobs, so jobs which other mods append later are taken along.
+        self.jobs = jobs
+        super().__init__()
+
+    def fused_jobs(self):
+        # Jobs of other mods may not derive from this BackgroundJob.
+        return [job for job in self.jobs
+                if (job.work_left or job.unlimited_work) and not getattr(job, 'set_based', False)
+                and getattr(job, 'pending_sorties', lambda: None)() is not None]
+
+    def query_find_sorties(self, tour_cutoff):
+        jobs = self.fused_jobs()
+        if not jobs:
+            return Sortie.objects.none()
+
+        # due_<i> tells whether the i-th fused job still has to process the sortie.
+        due_annotations = {'due_{}'.format(i): Case(When(job.pending_sorties(), then=Value(True)),
+                                                    default=Value(False), output_field=BooleanField())
+                           for i, job in enumerate(jobs)}
+        return lean_sorties(
+            Sortie.objects.filter(reduce(operator.or_, [job.pending_sorties() for job in jobs]),
+                                  aircraft__cls_base='aircraft', tour__id__gte=tour_cutoff)
+            .annotate(**due_annotations)
+            .order_by('-tour__id', 'id'))
+
+    def compute_for_sorties(self, sorties):
+        jobs = self.fused_jobs()
+
+        def compute(sortie, uow):
+            for i, job in enumerate(jobs):
+                if getattr(sortie, 'due_{}'.format(i)):
+                    job.compute_in_unit_of_work(sortie, uow)
+
+        compute_in_batch(sorties, compute)
+
+    def compute_for_sortie(self, sortie):
+        self.compute_for_sorties(self.query_find_sorties(sortie.tour_id).filter(id=sortie.id))
+
+    def log_update(self, to_compute):
+        return '[mod_stats_by_aircraft]: Running {} background jobs in one pass. {} sorties left to process.' \
+            .format(len(self.fused_jobs()), to_compute)
+
+    def log_done(self):
+        return '[mod_stats_by_aircraft]: Completed running the background jobs in one pass.'
@@ -1,7 +1,11 @@
+from django.db.models import Q
+
 from .background_job import BackgroundJob
 from stats.models import Sortie
-from ..aircraft_mod_models import AircraftBucket
 from ..aircraft_stats_compute import process_aircraft_stats, process_log_entries, get_sortie_type
+from ..event_index import MissionEventIndex
+from ..unit_of_work import unit_of_work
+from ..sortie_loader import lean_sorties
 
 
 class PlayerRetroCompute(BackgroundJob):
@@ -15,31 +19,37 @@ class PlayerRetroCompute(BackgroundJob):
 
     """
 
+    def pending_sorties(self):
+        return Q(SortieAugmentation_MOD_STATS_BY_AIRCRAFT__player_stats_processed=False)
+
     def query_find_sorties(self, tour_cutoff):
-        return (Sortie.objects.filter(SortieAugmentation_MOD_STATS_BY_AIRCRAFT__player_stats_processed=False,
-                                      aircraft__cls_base='aircraft', tour__id__gte=tour_cutoff)
-                .order_by('-tour__id', 'id'))
+        return lean_sorties(
+            Sortie.objects.filter(self.pending_sorties(), aircraft__cls_base='aircraft', tour__id__gte=tour_cutoff)
+            .order_by('-tour__id', 'id'))
 
-    def compute_for_sortie(self, sortie):
-        process_aircraft_stats(sortie, sortie.player, is_retro_compute=True)
+    def compute_in_unit_of_work(self, sortie, uow):
+        event_index = MissionEventIndex.for_sortie(sortie)
+        process_aircraft_stats(sortie, sortie.player, is_retro_compute=True, event_index=event_index, uow=uow)
 
-        bucket = (AircraftBucket.objects.get_or_create(tour=sortie.tour, aircraft=sortie.aircraft,
-                                                       filter_type='NO_FILTER', player=None))[0]
+        bucket = uow.bucket(sortie.tour, sortie.aircraft, 'NO_FILTER', None)
         filter_type = get_sortie_type(sortie)
         has_subtype = filter_type != 'NO_FILTER'
 
         # To update killboards of buckets with Player shotdown in this sortie,
         # and also AA/accident shotdowns/deaths
-        process_log_entries(bucket, sortie, has_subtype, False, stop_update_primary_bucket=True)
-        bucket.save()
+        process_log_entries(bucket, sortie, has_subtype, False, stop_update_primary_bucket=True,
+                            event_index=event_index, uow=uow)
 
         if has_subtype:
-            bucket = (AircraftBucket.objects.get_or_create(tour=sortie.tour, aircraft=sortie.aircraft,
-                                                           filter_type=filter_type, player=None))[0]
+            bucket = uow.bucket(sortie.tour, sortie.aircraft, filter_type, None)
             # To update killboards of buckets with Player shotdown in this sortie,
             # and also AA/accident shotdowns/deaths
-            process_log_entries(bucket, sortie, True, True, stop_update_primary_bucket=True)
-            bucket.save()
+            process_log_entries(bucket, sortie, True, True, stop_update_primary_bucket=True,
+                                event_index=event_index, uow=uow)
+
+    def compute_for_sortie(self, sortie):
+        with unit_of_work() as uow:
+            self.compute_in_unit_of_work(sortie, uow)
 
     def log_update(self, to_compute):
         return '[mod_stats_by_aircraft]: Retroactively computing player aircraft stats. {} sorties left to process.' \
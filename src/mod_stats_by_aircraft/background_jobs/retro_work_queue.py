@@ -0,0 +1,148 @@
+import multiprocessing
+import time
+
+from django import db
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from stats.logger import logger
+from .background_job import get_tour_cutoff
+from .run_background_jobs import jobs, SORTIES_PER_BATCH
+from ..aircraft_mod_models import AircraftRetroChunk
+from ..db_utils import lock_aircraft_stats
+from ..process_workers import init_retro_worker, drain_retro_queue
+
+# How long a worker waits before it tries again, if all chunks left are claimed or wait for a claimed chunk.
+IDLE_SECONDS = 1
+
+
+def enqueue_retro_chunks():
+    """
+    Splits the work left for the background jobs into AircraftRetroChunks of up to SORTIES_PER_BATCH consecutive
+    sorties of one tour. Only done if the queue is empty, so a run which was killed resumes with the chunks it left.
+
+    The chunks are created in the order of the jobs, and by sortie id within a tour. Since all buckets and killboards
+    belong to one tour, the tours are independent of each other, while the order within a tour matters for Elo and
+    streaks. So the workers process different tours at the same time, but the chunks of a tour one after the other.
+
+    @returns Number of chunks in the queue.
+    """
+    with transaction.atomic():
+        # Waits for the background jobs which the stats process is running, see run_background_jobs.
+        lock_aircraft_stats(exclusive=True)
+        # Serializes concurrent calls, so that the queue is filled only once.
+        with db.connection.cursor() as cursor:
+            cursor.execute('LOCK TABLE "{}" IN EXCLUSIVE MODE'.format(AircraftRetroChunk._meta.db_table))
+        if AircraftRetroChunk.objects.exists():
+            return AircraftRetroChunk.objects.count()
+
+        tour_cutoff = get_tour_cutoff()
+        if tour_cutoff is None:
+            return 0
+
+        chunks = []
+        for job in jobs:
+            chunk = None
+            sorties = (job.query_find_sorties(tour_cutoff).order_by('tour_id', 'id')
+                       .values_list('tour_id', 'id').iterator())
+            for tour_id, sortie_id in sorties:
+                if chunk is None or chunk.tour_id != tour_id or nr_sorties == SORTIES_PER_BATCH:
+                    chunk = AircraftRetroChunk(tour_id=tour_id, job=type(job).__name__, first_sortie_id=sortie_id)
+                    chunks.append(chunk)
+                    nr_sorties = 0
+                nr_sorties += 1
+                chunk.last_sortie_id = sortie_id
+
+        AircraftRetroChunk.objects.bulk_create(chunks, batch_size=SORTIES_PER_BATCH)
+        return len(chunks)
+
+
+def process_retro_chunk():
+    """
+    Claims the first chunk of some tour which no other worker is processing, has its job compute the sorties of the
+    chunk, and removes the chunk. Both happen in one transaction, so a chunk stays queued until its stats are committed.
+
+    The job queries the sorties of the chunk again, so sorties which were processed in the meantime are skipped.
+
+    @returns True if a chunk was processed, False if there is no chunk left to claim.
+    """
+    jobs_by_name = {type(job).__name__: job for job in jobs}
+    earlier_chunks = AircraftRetroChunk.objects.filter(tour_id=OuterRef('tour_id'), id__lt=OuterRef('id'))
+    with transaction.atomic():
+        # Skip locked chunks, so that several workers never process the same chunk. The later chunks of their tours
+        # wait until they are done, since they still have an earlier chunk.
+        chunk = (AircraftRetroChunk.objects.annotate(has_earlier=Exists(earlier_chunks)).filter(has_earlier=False)
+                 .select_for_update(skip_locked=True).order_by('id').first())
+        if chunk is None:
+            return False
+        # Waits for the stats process, if it writes a mission of the same tour.
+        lock_aircraft_stats(tour_ids=[chunk.tour_id])
+
+        job = jobs_by_name.get(chunk.job)
+        if job is not None:
+            job.compute_for_sorties(job.query_find_sorties(chunk.tour_id)
+                                    .filter(tour_id=chunk.tour_id, id__gte=chunk.first_sortie_id,
+                                            id__lte=chunk.last_sortie_id))
+        else:
+            logger.warning('[mod_stats_by_aircraft]: Unknown background job {} in the retro compute queue, skipped.'
+                           .format(chunk.job))
+        chunk.delete()
+
+    return True
+
+
+def run_retro_workers(processes):
+    """
+    Fills the queue with enqueue_retro_chunks, and drains it with the given number of worker processes.
+
+    If the run fails or is interrupted, the chunks left are removed. Their sorties are still found by the background
+    jobs, so stats.cmd or the next run picks them up again.
+    """
+    nr_chunks = enqueue_retro_chunks()
+    logger.info('[mod_stats_by_aircraft]: Retroactively computing {} chunks of up to {} sorties with {} processes.'
+                .format(nr_chunks, SORTIES_PER_BATCH, processes))
+    if nr_chunks == 0:
+        return
+
+    # The worker processes open their own connections.
+    db.connections.close_all()
+    completed = False
+    try:
+        # Spawned like on Windows on every platform, so that the workers behave the same everywhere. See
+        # process_workers.
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(processes, initializer=init_retro_worker) as pool:
+            chunks_done = sum(pool.map(drain_retro_queue, range(processes)))
+        completed = True
+    finally:
+        if not completed:
+            # Leaving the chunks behind would keep stats.cmd from running the background jobs.
+            cleared = clear_retro_queue()
+            logger.warning('[mod_stats_by_aircraft]: Retroactive compute failed, removed the {} chunks left in '
+                           'its queue.'.format(cleared))
+    logger.info('[mod_stats_by_aircraft]: Completed retroactively computing {} chunks.'.format(chunks_done))
+
+
+def clear_retro_queue():
+    """
+    Removes all chunks from the queue. Only safe while no retro compute workers are running.
+
+    @returns Number of chunks removed.
+    """
+    return AircraftRetroChunk.objects.all().delete()[0]
+
+
+def drain_queue():
+    """
+    Processes chunks until the queue is empty. Run by each worker process, see process_workers.drain_retro_queue.
+
+    @returns Number of chunks processed.
+    """
+    chunks_done = 0
+    while True:
+        if process_retro_chunk():
+            chunks_done += 1
+        elif AircraftRetroChunk.objects.exists():
+            time.sleep(IDLE_SECONDS)
+        else:
+            return chunks_done
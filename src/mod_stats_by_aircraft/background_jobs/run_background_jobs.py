@@ -1,4 +1,7 @@
+import time
+
 from django.db import transaction
+from django.db.models import Q
 
 from .background_job import get_tour_cutoff
 from .fix_captures import FixCaptures
@@ -10,15 +13,38 @@ from .fix_turret_killboards import FixTurretKillboards
 from .fix_no_deaths_player_kb import FixNoDeathsPlayerKB
 from .fix_accuracy import FixAccuracy
 from .update_ammo_breakdown import UpdateAmmoBreakdown
+from .classify_sortie_variants import ClassifySortieVariants
+from .fix_lethality import FixLethality
+from .fused_background_job import FusedBackgroundJob
+from ..aircraft_mod_models import AircraftRetroChunk, AircraftBackgroundJobState
+from ..db_utils import lock_aircraft_stats
 from stats.logger import logger
+import config
 
 # Subclasses of BackgroundJob, see background_job.py
 jobs = [FullRetroCompute(), PlayerRetroCompute(), StreaksRetroCompute(), FixCorruptedAaAccidents(),
-        UpdateAmmoBreakdown(), FixTurretKillboards(), FixNoDeathsPlayerKB(), FixAccuracy(), FixCaptures()]
+        UpdateAmmoBreakdown(), FixTurretKillboards(), FixNoDeathsPlayerKB(), FixAccuracy(), FixCaptures(),
+        ClassifySortieVariants(), FixLethality()]
+# Runs the jobs above which can be fused in a single pass, before they run on their own.
+fused_job = FusedBackgroundJob(jobs)
 
 LOG_COUNTER = 0
 LOGGING_INTERVAL = 5  # How many batches are run before an update log is produced.
-SORTIES_PER_BATCH = 1000  # How many sorties computed per batch
+SORTIES_PER_BATCH = 1000  # How many sorties computed per batch at most
+SET_BASED_SORTIES_PER_BATCH = 100000  # Dito for jobs with BackgroundJob.set_based
+MIN_SORTIES_PER_BATCH = 10
+
+# How many seconds a batch should take. Each batch is one call of run_background_jobs, between which stats_whore.main
+# checks for new mission reports. So a new mission waits at most about this long for the background jobs.
+TIME_BUDGET = config.get_conf()['stats'].getfloat('background_jobs_time_budget')
+if TIME_BUDGET is None:
+    TIME_BUDGET = 2
+
+# Whether the pause for the retro compute queue was logged already.
+WARNED_RETRO_QUEUE = False
+
+# Class name of the job -> how many sorties it computes per batch, adapted to its measured sorties per second.
+BATCH_SIZES = dict()
 
 
 @transaction.atomic
@@ -33,6 +59,8 @@ def reset_corrupted_data():
     if tour_cutoff is None:
         return
 
+    # The retro compute workers may still write the buckets which are reset.
+    lock_aircraft_stats(exclusive=True)
     for job in jobs:
         job.reset_relevant_fields(tour_cutoff)
 
@@ -49,7 +77,24 @@ def run_background_jobs():
     if tour_cutoff is None:
         return False
 
-    for job in jobs:
+    # The jobs only run in the stats process, between the missions, and not alongside the retro compute workers. So
+    # the locks of the tours are not needed. Taken before the queue is checked, since enqueue_retro_chunks waits for
+    # this transaction.
+    lock_aircraft_stats()
+
+    # The retro compute workers are draining the queue, see retro_work_queue.py. Running the jobs here as well could
+    # process the same sorties twice, and overwrite what the workers write.
+    global WARNED_RETRO_QUEUE
+    if AircraftRetroChunk.objects.exists():
+        if not WARNED_RETRO_QUEUE:
+            logger.warning('[mod_stats_by_aircraft]: Background jobs paused while the retro compute queue has chunks. '
+                           'If the retro_compute_aircraft_stats command is no longer running, resume it, or clear the '
+                           'queue with "python manage.py retro_compute_aircraft_stats --clear".')
+            WARNED_RETRO_QUEUE = True
+        return False
+    WARNED_RETRO_QUEUE = False
+
+    for job in [fused_job] + jobs:
         work_done = __run_background_job(job, tour_cutoff)
         if work_done:
             return True
@@ -63,26 +108,62 @@ def __run_background_job(job, tour_cutoff):
 
     global LOG_COUNTER
 
-    backfill_sorties = job.query_find_sorties(tour_cutoff)
-    nr_left = backfill_sorties.count()
-    if nr_left == 0:
+    # The job continues after the last sortie of its previous batch, instead of searching all its sorties again.
+    state = AircraftBackgroundJobState.objects.select_for_update().get_or_create(job=type(job).__name__)[0]
+    backfill_sorties = job.query_find_sorties(tour_cutoff).order_by('-tour__id', 'id')
+    if state.sorties_left is None:
+        state.sorties_left = backfill_sorties.count()
+    if state.sorties_left == 0 and state.cursor_sortie_id is None:
+        state.sorties_left = None
+        state.save()
         job.work_left = False
         return False
 
-    if LOG_COUNTER == 0 and job.log_update(nr_left):
-        logger.info(job.log_update(nr_left))
-    LOG_COUNTER = (LOG_COUNTER + 1) % LOGGING_INTERVAL
-
-    for sortie in backfill_sorties[0:SORTIES_PER_BATCH]:
-        job.compute_for_sortie(sortie)
+    if state.cursor_sortie_id is not None:
+        backfill_sorties = backfill_sorties.filter(Q(tour__id__lt=state.cursor_tour_id) |
+                                                   Q(tour__id=state.cursor_tour_id, id__gt=state.cursor_sortie_id))
 
-    if nr_left <= SORTIES_PER_BATCH:
-        if job.log_done():
-            logger.info(job.log_done())
-        job.work_left = False
-        LOG_COUNTER = 0
+    if LOG_COUNTER == 0 and job.log_update(state.sorties_left):
+        logger.info(job.log_update(state.sorties_left))
+    LOG_COUNTER = (LOG_COUNTER + 1) % LOGGING_INTERVAL
 
-    return True
+    batch_size = BATCH_SIZES.get(type(job).__name__, MIN_SORTIES_PER_BATCH)
+    batch_keys = list(backfill_sorties.values_list('tour__id', 'id')[0:batch_size])
+    if batch_keys:
+        start, cpu_start = time.monotonic(), time.process_time()
+        job.compute_for_sorties(backfill_sorties[0:batch_size])
+        wall_seconds = time.monotonic() - start
+        state.record_batch(len(batch_keys), wall_seconds, time.process_time() - cpu_start)
+        __adapt_batch_size(job, len(batch_keys), wall_seconds)
+    state.sorties_left = max(0, state.sorties_left - len(batch_keys))
+
+    if len(batch_keys) == batch_size:
+        state.cursor_tour_id, state.cursor_sortie_id = batch_keys[-1]
+    else:
+        # End of the pass. Sorties may have become due behind the cursor in the meantime, e.g. by
+        # reset_relevant_fields, so the next call counts again and starts a new pass if there are any.
+        state.cursor_tour_id, state.cursor_sortie_id = None, None
+        state.sorties_left = None
+        if not job.query_find_sorties(tour_cutoff).exists():
+            if job.log_done():
+                logger.info(job.log_done())
+            job.work_left = False
+            LOG_COUNTER = 0
+    state.save()
+
+    return bool(batch_keys)
+
+
+def __adapt_batch_size(job, nr_sorties, seconds):
+    """
+    Sizes the next batch of the job so that it takes about TIME_BUDGET seconds, at the speed of the last batch. The
+    size changes by at most a factor of 2 per batch, so that a single slow or fast batch doesn't throw it off.
+    """
+    batch_size = BATCH_SIZES.get(type(job).__name__, MIN_SORTIES_PER_BATCH)
+    target = int(nr_sorties / max(seconds, 0.001) * TIME_BUDGET)
+    target = max(batch_size // 2, min(batch_size * 2, target))
+    max_batch_size = SET_BASED_SORTIES_PER_BATCH if getattr(job, 'set_based', False) else SORTIES_PER_BATCH
+    BATCH_SIZES[type(job).__name__] = max(MIN_SORTIES_PER_BATCH, min(max_batch_size, target))
 
 
 def retro_streak_compute_running():
@@ -2,7 +2,10 @@ from .background_job import BackgroundJob
 from stats.models import Sortie
 from ..aircraft_mod_models import AircraftBucket
 from ..aircraft_stats_compute import process_streaks_and_best_sorties, get_sortie_type
+from ..unit_of_work import unit_of_work
+from ..sortie_loader import lean_sorties
 from django.db import IntegrityError
+from django.db.models import Q
 
 
 class StreaksRetroCompute(BackgroundJob):
@@ -12,25 +15,28 @@ class StreaksRetroCompute(BackgroundJob):
     This retroactively computes streaks when updating the mod.
     """
 
+    def pending_sorties(self):
+        return Q(SortieAugmentation_MOD_STATS_BY_AIRCRAFT__computed_max_streaks=False, aircraft__isnull=False)
+
     def query_find_sorties(self, tour_cutoff):
-        return (Sortie.objects.filter(SortieAugmentation_MOD_STATS_BY_AIRCRAFT__computed_max_streaks=False,
-                                      aircraft__cls_base='aircraft', tour__id__gte=tour_cutoff, aircraft__isnull=False)
-                .order_by('-tour__id', 'id'))
+        return lean_sorties(
+            Sortie.objects.filter(self.pending_sorties(), aircraft__cls_base='aircraft', tour__id__gte=tour_cutoff)
+            .order_by('-tour__id', 'id'))
+
+    def compute_in_unit_of_work(self, sortie, uow):
+        buckets = [uow.bucket(sortie.tour, sortie.aircraft, 'NO_FILTER', sortie.player)]
+        filter_type = get_sortie_type(sortie)
+        has_subtype = filter_type != 'NO_FILTER'
+        if has_subtype:
+            buckets.append(uow.bucket(sortie.tour, sortie.aircraft, filter_type, sortie.player))
+
+        for bucket in buckets:
+            process_streaks_and_best_sorties(bucket, sortie, uow)
 
     def compute_for_sortie(self, sortie):
         try:
-            buckets = [(AircraftBucket.objects.get_or_create(tour=sortie.tour, aircraft=sortie.aircraft,
-                                                             filter_type='NO_FILTER', player=sortie.player))[0]]
-            filter_type = get_sortie_type(sortie)
-            has_subtype = filter_type != 'NO_FILTER'
-            if has_subtype:
-                buckets.append((AircraftBucket.objects.get_or_create(tour=sortie.tour, aircraft=sortie.aircraft,
-                                                                     filter_type=filter_type, player=sortie.player))[0])
-
-            for bucket in buckets:
-                process_streaks_and_best_sorties(bucket, sortie)
-                bucket.update_derived_fields()
-                bucket.save()
+            with unit_of_work() as uow:
+                self.compute_in_unit_of_work(sortie, uow)
         # A few sorties pass a null aircraft to a bucket in here.
         # Not sure why - seems to be an edge case, so we just ignore those sorties.
         except AircraftBucket.DoesNotExist:
@@ -2,9 +2,12 @@ from .background_job import BackgroundJob
 from stats.models import Sortie
 from ..aircraft_mod_models import AircraftBucket, default_ammo_breakdown
 from ..aircraft_stats_compute import get_sortie_type, process_ammo_breakdown
+from ..event_index import MissionEventIndex
+from ..unit_of_work import unit_of_work
 from django.db.models import Q
 
 from ..ammo_file_manager import reset_ammo_breakdown_csvs
+from ..sortie_loader import lean_sorties
 
 
 class UpdateAmmoBreakdown(BackgroundJob):
@@ -23,32 +26,32 @@ class UpdateAmmoBreakdown(BackgroundJob):
         if updated:
             reset_ammo_breakdown_csvs()
 
+    def pending_sorties(self):
+        return (Q(SortieAugmentation_MOD_STATS_BY_AIRCRAFT__recomputed_ammo_breakdown=False) |
+                Q(SortieAugmentation_MOD_STATS_BY_AIRCRAFT__recomputed_ammo_breakdown_2=False))
+
     def query_find_sorties(self, tour_cutoff):
-        return (Sortie.objects.filter(Q(SortieAugmentation_MOD_STATS_BY_AIRCRAFT__recomputed_ammo_breakdown=False) |
-                                      Q(SortieAugmentation_MOD_STATS_BY_AIRCRAFT__recomputed_ammo_breakdown_2=False),
-                                      aircraft__cls_base='aircraft', tour__id__gte=tour_cutoff)
-                .order_by('-tour__id'))
+        return lean_sorties(
+            Sortie.objects.filter(self.pending_sorties(), aircraft__cls_base='aircraft', tour__id__gte=tour_cutoff)
+            .order_by('-tour__id'))
 
-    def compute_for_sortie(self, sortie):
+    def compute_in_unit_of_work(self, sortie, uow):
         if 'ammo_breakdown' in sortie.ammo:
-            buckets = [(AircraftBucket.objects.get_or_create(tour=sortie.tour, aircraft=sortie.aircraft,
-                                                             filter_type='NO_FILTER', player=None))[0],
-                       (AircraftBucket.objects.get_or_create(tour=sortie.tour, aircraft=sortie.aircraft,
-                                                             filter_type='NO_FILTER', player=sortie.player))[0]]
+            buckets = [uow.bucket(sortie.tour, sortie.aircraft, 'NO_FILTER', None),
+                       uow.bucket(sortie.tour, sortie.aircraft, 'NO_FILTER', sortie.player)]
             filter_type = get_sortie_type(sortie)
             if filter_type != 'NO_FILTER':
-                buckets.append((AircraftBucket.objects.get_or_create(tour=sortie.tour, aircraft=sortie.aircraft,
-                                                                     filter_type=filter_type, player=None))[0])
-                buckets.append((AircraftBucket.objects.get_or_create(tour=sortie.tour, aircraft=sortie.aircraft,
-                                                                     filter_type=filter_type, player=sortie.player))[0])
+                buckets.append(uow.bucket(sortie.tour, sortie.aircraft, filter_type, None))
+                buckets.append(uow.bucket(sortie.tour, sortie.aircraft, filter_type, sortie.player))
+            event_index = MissionEventIndex.for_sortie(sortie)
             for bucket in buckets:
-                process_ammo_breakdown(bucket, sortie, bucket.filter_type != 'NO_FILTER')
-                bucket.save()
+                process_ammo_breakdown(bucket, sortie, bucket.filter_type != 'NO_FILTER', event_index, uow)
 
-        sortie.SortieAugmentation_MOD_STATS_BY_AIRCRAFT.recomputed_ammo_breakdown = True
-        sortie.SortieAugmentation_MOD_STATS_BY_AIRCRAFT.recomputed_ammo_breakdown_2 = True
-        sortie.SortieAugmentation_MOD_STATS_BY_AIRCRAFT.save()
-        pass
+        uow.mark_sortie(sortie, 'recomputed_ammo_breakdown', 'recomputed_ammo_breakdown_2')
+
+    def compute_for_sortie(self, sortie):
+        with unit_of_work() as uow:
+            self.compute_in_unit_of_work(sortie, uow)
 
     def log_update(self, to_compute):
         return '[mod_stats_by_aircraft]: Updating ammo breakdowns. {} sorties left to process.' \
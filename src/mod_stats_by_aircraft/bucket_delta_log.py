@@ -0,0 +1,103 @@
+import time
+
+from django.db import transaction
+
+import config
+
+from .aircraft_mod_models import AircraftBucket, AircraftBucketDelta
+from .contributions import BucketChanges, apply_bucket_entry
+from .db_utils import bulk_update, lock_aircraft_stats
+from .unit_of_work import GLOBAL_BUCKET_UPDATE_FIELDS
+
+# Every how many seconds the delta log is folded into the buckets. 0 disables the delta log.
+COMPACT_INTERVAL = config.get_conf()['stats'].getint('aircraft_stats_compact_interval')
+if COMPACT_INTERVAL is None:
+    COMPACT_INTERVAL = 0
+# How many deltas are folded per transaction.
+COMPACT_BATCH_SIZE = 5000
+
+LAST_COMPACTION = {'time': 0}
+
+
+def bucket_delta_log():
+    """
+    @returns A new BucketDeltaLog for a StatsUnitOfWork, or None if the delta log is disabled.
+    """
+    return BucketDeltaLog() if COMPACT_INTERVAL > 0 else None
+
+
+class BucketDeltaLog(BucketChanges):
+    """
+    The buckets without player of popular aircraft are changed by nearly every sortie. If several processes write them
+    directly, each one waits for the row locks of the others.
+
+    With the delta log, a StatsUnitOfWork appends the changes to these buckets as AircraftBucketDelta rows instead,
+    which never conflict. compact_bucket_deltas folds them into the buckets every COMPACT_INTERVAL seconds, so the
+    buckets lag behind by at most that long. The records of the buckets are still raised directly by the
+    StreakLeaderboard, since they rarely change.
+
+    Elo is recorded as a difference too, so an encounter is rated against the Elo of the last compaction.
+    """
+
+    def append(self, buckets):
+        """
+        Appends the changes of the buckets to the delta log, with a single INSERT.
+
+        @param buckets Buckets without player which were handed out, with all changes applied.
+        """
+        deltas = []
+        for bucket in buckets:
+            changes = self.entry(bucket)
+            if changes is not None:
+                changes['coalition'] = bucket.coalition
+                deltas.append(AircraftBucketDelta(bucket_id=bucket.id, changes=changes))
+        AircraftBucketDelta.objects.bulk_create(deltas)
+        self.clear()
+
+
+def compact_bucket_deltas(batch_size=COMPACT_BATCH_SIZE):
+    """
+    Folds the oldest deltas into their buckets, updates the derived fields of those buckets once, and deletes the
+    deltas. Deltas locked by another compaction are skipped.
+
+    @returns How many deltas were folded.
+    """
+    with transaction.atomic():
+        deltas = list(AircraftBucketDelta.objects.select_for_update(skip_locked=True).order_by('id')[:batch_size])
+        if not deltas:
+            return 0
+
+        bucket_ids = {delta.bucket_id for delta in deltas}
+        # Waits for the retro compute workers which write the same tours, since they write the buckets directly.
+        lock_aircraft_stats(tour_ids=AircraftBucket.objects.filter(id__in=bucket_ids)
+                            .values_list('tour_id', flat=True).distinct())
+        buckets = {bucket.id: bucket for bucket in AircraftBucket.objects.select_for_update()
+                   .select_related('tour', 'aircraft', 'player')
+                   .filter(id__in=bucket_ids).order_by('id')}
+        for delta in deltas:
+            bucket = buckets[delta.bucket_id]
+            apply_bucket_entry(bucket, delta.changes)
+            bucket.coalition = delta.changes['coalition']
+        for bucket in buckets.values():
+            bucket.update_derived_fields()
+        bulk_update(AircraftBucket, buckets.values(), GLOBAL_BUCKET_UPDATE_FIELDS)
+        AircraftBucketDelta.objects.filter(id__in=[delta.id for delta in deltas]).delete()
+    return len(deltas)
+
+
+def compact_all_bucket_deltas():
+    """
+    Folds every delta into the buckets. Used before the buckets are changed other than by adding onto them.
+    """
+    while compact_bucket_deltas():
+        pass
+    LAST_COMPACTION['time'] = time.monotonic()
+
+
+def compact_bucket_deltas_if_due():
+    """
+    Called by the stats loop. Folds the delta log into the buckets if the last compaction is COMPACT_INTERVAL ago.
+    """
+    if COMPACT_INTERVAL <= 0 or time.monotonic() - LAST_COMPACTION['time'] < COMPACT_INTERVAL:
+        return
+    compact_all_bucket_deltas()
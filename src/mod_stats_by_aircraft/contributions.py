@@ -0,0 +1,200 @@
+import copy
+
+from django.db import transaction
+
+from stats.logger import logger
+from .aircraft_mod_models import AircraftBucket, AircraftKillboard, AircraftStatsContribution, RECEIVED
+from .db_utils import bulk_update, update_increment, lock_aircraft_stats
+from .unit_of_work import (BUCKET_COUNTER_FIELDS, BUCKET_COUNTER_DICT_FIELDS, BUCKET_UPDATE_FIELDS,
+                           KILLBOARD_NATURAL_KEY, KILLBOARD_COUNTER_FIELDS)
+
+
+class BucketChanges:
+    """
+    Records what a StatsUnitOfWork adds onto its buckets. The counters, the killboard dicts and the Elo of a bucket are
+    recorded as the difference between their current values and those when the bucket was handed out. Ammo breakdown
+    samples are recorded one by one, see increment_ammo.
+    """
+
+    def __init__(self):
+        # Bucket id -> (counters, dict counters, elo) when the bucket was handed out.
+        self.snapshots = dict()
+        # Bucket id -> [[side, ammo_dict, pilot_snipe], ...]
+        self.ammo = dict()
+
+    def snapshot(self, bucket):
+        self.snapshots[bucket.id] = ({field: getattr(bucket, field) for field in BUCKET_COUNTER_FIELDS},
+                                     copy.deepcopy({field: getattr(bucket, field)
+                                                    for field in BUCKET_COUNTER_DICT_FIELDS}),
+                                     bucket.elo)
+
+    def add_ammo(self, bucket, side, ammo_dict, pilot_snipe):
+        self.ammo.setdefault(bucket.id, []).append([side, ammo_dict, pilot_snipe])
+
+    def entry(self, bucket):
+        """
+        @returns Dict with the changes of the bucket, see AircraftStatsContribution.buckets. None if it didn't change.
+        """
+        counters_before, dict_counters_before, elo_before = self.snapshots[bucket.id]
+        counters = {field: getattr(bucket, field) - counters_before[field] for field in BUCKET_COUNTER_FIELDS
+                    if getattr(bucket, field) != counters_before[field]}
+        dict_counters = dict()
+        for field in BUCKET_COUNTER_DICT_FIELDS:
+            before = dict_counters_before[field]
+            deltas = {key: value - before.get(key, 0) for key, value in getattr(bucket, field).items()
+                      if value != before.get(key, 0)}
+            if deltas:
+                dict_counters[field] = deltas
+        elo = bucket.elo - elo_before
+        ammo = self.ammo.get(bucket.id, [])
+
+        if not counters and not dict_counters and not elo and not ammo:
+            return None
+        return {'bucket': bucket.id, 'counters': counters, 'dict_counters': dict_counters, 'elo': elo, 'ammo': ammo}
+
+    def clear(self):
+        self.snapshots.clear()
+        self.ammo.clear()
+
+
+class ContributionRecorder(BucketChanges):
+    """
+    Records what a StatsUnitOfWork adds onto its buckets and killboards while it processes a mission, and stores it as
+    the AircraftStatsContribution of the mission on flush. retract_mission subtracts it again.
+    """
+
+    def __init__(self, mission_id):
+        super().__init__()
+        self.mission_id = mission_id
+
+    def save(self, buckets, killboards):
+        """
+        Adds the changes of the buckets and killboards onto the AircraftStatsContribution of the mission.
+
+        @param buckets The buckets handed out, with all changes applied.
+        @param killboards The KillboardDeltas.
+        """
+        bucket_entries = [entry for entry in (self.entry(bucket) for bucket in buckets) if entry is not None]
+        killboard_entries = []
+        for delta in killboards:
+            counters = {field: getattr(delta, field) for field in KILLBOARD_COUNTER_FIELDS if getattr(delta, field)}
+            if counters:
+                killboard_entries.append([delta.aircraft_1.id, delta.aircraft_2.id, delta.tour.id, counters])
+
+        self.clear()
+        if not bucket_entries and not killboard_entries:
+            return
+
+        contribution = AircraftStatsContribution.objects.get_or_create(mission_id=self.mission_id)[0]
+        contribution.buckets += bucket_entries
+        contribution.killboards += killboard_entries
+        contribution.save()
+
+
+def retract_mission(mission_id):
+    """
+    Subtracts the recorded AircraftStatsContribution of the mission from the buckets and killboards. Its sorties stay
+    marked as processed in their SortieAugmentation, so that no job adds them again.
+
+    Only the counters, killboards, Elo and ammo breakdown counts are reversed. The reservoir samples of the ammo
+    breakdowns, the streaks and the best sorties can't be reversed, they keep what the mission contributed.
+
+    @returns True if the mission was retracted, False if there is nothing (left) to retract.
+    """
+    # Imported here, since bucket_delta_log builds on this module.
+    from .bucket_delta_log import compact_all_bucket_deltas
+
+    with transaction.atomic():
+        # The stats process and the retro compute workers read the buckets without row locks, and write them back
+        # whole. So everyone else has to wait until the retraction is committed, see lock_aircraft_stats.
+        lock_aircraft_stats(exclusive=True)
+        # The ammo samples of a bucket can only be removed once they were added onto it.
+        compact_all_bucket_deltas()
+        contribution = (AircraftStatsContribution.objects.select_for_update()
+                        .filter(mission_id=mission_id, retracted=False).first())
+        if contribution is None:
+            return False
+
+        # No one else writes the buckets until the commit, so writing back all fields loses no concurrent update.
+        buckets = {bucket.id: bucket for bucket in AircraftBucket.objects.select_for_update()
+                   .select_related('tour', 'aircraft', 'player')
+                   .filter(id__in={entry['bucket'] for entry in contribution.buckets})}
+        for entry in contribution.buckets:
+            # Duplicate buckets were merged by migration 0016, what they got from the mission can't be found anymore.
+            if entry['bucket'] in buckets:
+                apply_bucket_entry(buckets[entry['bucket']], entry, -1)
+        for bucket in buckets.values():
+            bucket.update_derived_fields()
+        bulk_update(AircraftBucket, sorted(buckets.values(), key=lambda bucket: bucket.id), BUCKET_UPDATE_FIELDS)
+
+        killboard_bucket_ids = {bucket_id for row in contribution.killboards for bucket_id in row[:2]}
+        existing_bucket_ids = set(AircraftBucket.objects.filter(id__in=killboard_bucket_ids)
+                                  .values_list('id', flat=True))
+        killboard_counters = dict()
+        for aircraft_1_id, aircraft_2_id, tour_id, counters in contribution.killboards:
+            if aircraft_1_id not in existing_bucket_ids or aircraft_2_id not in existing_bucket_ids:
+                continue
+            summed = killboard_counters.setdefault((aircraft_1_id, aircraft_2_id, tour_id), dict())
+            for field, value in counters.items():
+                summed[field] = summed.get(field, 0) + value
+        # Only existing killboards are updated. A killboard which is gone, e.g. deleted by targeted_recompute, would
+        # otherwise be inserted with negative counters.
+        update_increment(AircraftKillboard, KILLBOARD_NATURAL_KEY, KILLBOARD_COUNTER_FIELDS,
+                         [key + tuple(-counters.get(field, 0) for field in KILLBOARD_COUNTER_FIELDS)
+                          for key, counters in killboard_counters.items()])
+
+        contribution.retracted = True
+        contribution.save(update_fields=['retracted'])
+
+    logger.info('[mod_stats_by_aircraft]: Retracted aircraft stats of mission {}, {} buckets, {} killboards.'
+                .format(mission_id, len(buckets), len(killboard_counters)))
+    return True
+
+
+def forget_buckets(bucket_ids, tour_cutoff):
+    """
+    Removes the given buckets and their killboards from the contributions which are not retracted yet. Called by
+    targeted_recompute once it reset the buckets, since what the missions contributed to them is computed anew.
+    Otherwise retract_mission would subtract it a second time.
+
+    @param bucket_ids Ids of the buckets which were reset.
+    @param tour_cutoff The first tour which was recomputed. The buckets belong to it or to later tours.
+    """
+    bucket_ids = set(bucket_ids)
+    contributions = (AircraftStatsContribution.objects.select_for_update()
+                     .filter(retracted=False, mission__tour_id__gte=tour_cutoff).order_by('id'))
+    for contribution in contributions:
+        buckets = [entry for entry in contribution.buckets if entry['bucket'] not in bucket_ids]
+        killboards = [row for row in contribution.killboards if row[0] not in bucket_ids and row[1] not in bucket_ids]
+        if len(buckets) != len(contribution.buckets) or len(killboards) != len(contribution.killboards):
+            contribution.buckets = buckets
+            contribution.killboards = killboards
+            contribution.save(update_fields=['buckets', 'killboards'])
+
+
+def apply_bucket_entry(bucket, entry, sign=1):
+    """
+    Adds (sign 1) or subtracts (sign -1) the changes recorded by BucketChanges.entry onto bucket.
+    """
+    for field, delta in entry['counters'].items():
+        setattr(bucket, field, getattr(bucket, field) + sign * delta)
+    for field, deltas in entry['dict_counters'].items():
+        counts = getattr(bucket, field)
+        for key, delta in deltas.items():
+            counts[key] = counts.get(key, 0) + sign * delta
+            if counts[key] == 0:
+                del counts[key]
+    bucket.elo += sign * entry['elo']
+    if sign > 0:
+        for side, ammo_dict, pilot_snipe in entry['ammo']:
+            if side == RECEIVED:
+                bucket.increment_ammo_received(ammo_dict, pilot_snipe)
+            else:
+                bucket.increment_ammo_given(ammo_dict, pilot_snipe)
+    else:
+        # The samples were added in order, so they are removed in reverse order.
+        for side, ammo_dict, pilot_snipe in reversed(entry['ammo']):
+            if side == RECEIVED:
+                bucket.decrement_ammo_received(ammo_dict, pilot_snipe)
+            else:
+                bucket.decrement_ammo_given(ammo_dict, pilot_snipe)
@@ -0,0 +1,152 @@
+import numpy as np
+
+# The fields of a sortie which the bucket counters are computed from.
+SORTIE_DTYPE = np.dtype([
+    ('is_not_takeoff', np.bool_),
+    ('flight_time', np.int64),
+    ('ak_total', np.int64),
+    ('gk_total', np.int64),
+    ('ak_assist', np.int64),
+    ('score', np.int64),
+    ('is_lost_aircraft', np.bool_),
+    ('is_dead', np.bool_),
+    ('is_captured', np.bool_),
+    ('is_bailout', np.bool_),
+    ('is_ditched', np.bool_),
+    ('is_landed', np.bool_),
+    ('is_in_flight', np.bool_),
+    ('is_crashed', np.bool_),
+    ('is_shotdown', np.bool_),
+    ('is_relive', np.bool_),
+    ('is_damaged', np.bool_),
+    # Bug work around. Bailout results in all ammo being used according to logs.
+    # Rearming (and as such taking off twice) resets ammo used according to logs.
+    ('counts_ammo', np.bool_),
+    ('used_cartridges', np.int64),
+    ('hit_bullets', np.int64),
+    ('used_bombs', np.int64),
+    ('hit_bombs', np.int64),
+    ('used_rockets', np.int64),
+    ('hit_rockets', np.int64),
+])
+
+# The AircraftBucket counters every sortie adds onto its buckets, in the order of the columns of counter_columns.
+SORTIE_COUNTER_FIELDS = [
+    'total_sorties', 'total_flight_time', 'kills', 'ground_kills', 'assists', 'aircraft_lost', 'score', 'deaths',
+    'captures', 'bailouts', 'ditches', 'landings', 'in_flight', 'crashes', 'shotdown',
+    'sorties_plane_was_hit', 'plane_survivability_counter', 'pilot_survivability_counter',
+    'ammo_shot', 'ammo_hit', 'bomb_rocket_shot', 'bomb_rocket_hit',
+]
+
+
+def sortie_row(sortie, takeoff_count):
+    """
+    @param takeoff_count How many times the sortie took off, see MissionEventIndex.takeoff_count.
+    @returns Tuple with the values of SORTIE_DTYPE for the sortie.
+    """
+    ammo = sortie.ammo
+    return (
+        sortie.is_not_takeoff, sortie.flight_time, sortie.ak_total, sortie.gk_total, sortie.ak_assist, sortie.score,
+        sortie.is_lost_aircraft, sortie.is_dead, sortie.is_captured, sortie.is_bailout, sortie.is_ditched,
+        sortie.is_landed, sortie.is_in_flight, sortie.is_crashed, sortie.is_shotdown, sortie.is_relive,
+        bool(sortie.damage), not sortie.is_bailout and takeoff_count <= 1,
+        ammo['used_cartridges'] or 0, ammo['hit_bullets'] or 0, ammo['used_bombs'] or 0, ammo['hit_bombs'] or 0,
+        ammo['used_rockets'] or 0, ammo['hit_rockets'] or 0,
+    )
+
+
+def counter_columns(sorties):
+    """
+    @param sorties Structured array of SORTIE_DTYPE.
+    @returns Array of shape (len(sorties), len(SORTIE_COUNTER_FIELDS)) with what each sortie adds to its buckets.
+    """
+    took_off = ~sorties['is_not_takeoff']
+    counts_ammo = sorties['counts_ammo']
+    damaged = sorties['is_damaged']
+    columns = [
+        took_off,
+        np.where(took_off, sorties['flight_time'], 0),
+        sorties['ak_total'],
+        sorties['gk_total'],
+        sorties['ak_assist'],
+        sorties['is_lost_aircraft'],
+        sorties['score'],
+        sorties['is_dead'],
+        sorties['is_captured'] & ~sorties['is_dead'],
+        sorties['is_bailout'],
+        sorties['is_ditched'],
+        sorties['is_landed'],
+        sorties['is_in_flight'],
+        sorties['is_crashed'],
+        sorties['is_shotdown'],
+        damaged,
+        damaged & ~sorties['is_lost_aircraft'],
+        damaged & ~sorties['is_relive'],
+        np.where(counts_ammo, sorties['used_cartridges'], 0),
+        np.where(counts_ammo, sorties['hit_bullets'], 0),
+        np.where(counts_ammo, sorties['used_bombs'] + sorties['used_rockets'], 0),
+        np.where(counts_ammo, sorties['hit_bombs'] + sorties['hit_rockets'], 0),
+    ]
+    return np.stack([column.astype(np.int64) for column in columns], axis=1)
+
+
+def counter_matrix(sorties, sortie_indices, group_indices, nr_groups):
+    """
+    Sums up the counters of the sorties per group, e.g. per bucket.
+
+    @param sorties Structured array of SORTIE_DTYPE.
+    @param sortie_indices Array with an index into sorties for each membership of a sortie in a group.
+    @param group_indices Array with the group of each membership, in range(nr_groups).
+    @returns Array of shape (nr_groups, len(SORTIE_COUNTER_FIELDS)).
+    """
+    matrix = np.zeros((nr_groups, len(SORTIE_COUNTER_FIELDS)), dtype=np.int64)
+    np.add.at(matrix, group_indices, counter_columns(sorties)[sortie_indices])
+    return matrix
+
+
+class SortieCounters:
+    """
+    Collects which sorties count towards which buckets, and adds the counters of SORTIE_COUNTER_FIELDS onto the
+    buckets all at once with apply.
+
+    Before, process_bucket added onto each counter one sortie at a time. Now the sorties are put into a NumPy array,
+    and summed up per bucket with a single np.add.at.
+    """
+
+    def __init__(self):
+        self.rows = []
+        self.sortie_indices = dict()
+        self.memberships = []
+
+    def add(self, bucket, sortie, takeoff_count):
+        if sortie.id not in self.sortie_indices:
+            self.sortie_indices[sortie.id] = len(self.rows)
+            self.rows.append(sortie_row(sortie, takeoff_count))
+        self.memberships.append((bucket, self.sortie_indices[sortie.id]))
+
+    def apply(self):
+        """
+        Adds the counters of the collected sorties onto their buckets, then forgets them.
+        """
+        if not self.memberships:
+            return
+
+        buckets = []
+        group_of_bucket = dict()
+        group_indices = []
+        for bucket, _ in self.memberships:
+            if id(bucket) not in group_of_bucket:
+                group_of_bucket[id(bucket)] = len(buckets)
+                buckets.append(bucket)
+            group_indices.append(group_of_bucket[id(bucket)])
+
+        matrix = counter_matrix(np.array(self.rows, dtype=SORTIE_DTYPE),
+                                np.array([index for _, index in self.memberships], dtype=np.int64),
+                                np.array(group_indices, dtype=np.int64), len(buckets))
+        for bucket, counters in zip(buckets, matrix.tolist()):
+            for field, value in zip(SORTIE_COUNTER_FIELDS, counters):
+                setattr(bucket, field, getattr(bucket, field) + value)
+
+        self.rows = []
+        self.sortie_indices = dict()
+        self.memberships = []
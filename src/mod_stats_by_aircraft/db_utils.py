@@ -0,0 +1,369 @@
+import csv
+import io
+import json
+from contextlib import contextmanager
+
+from django.db import connection
+from django.db.models import Case, When, Value
+from django.db.models.functions import Cast
+
+
+def bulk_update(model, objs, fields, batch_size=100):
+    """
+    Writes the given fields of already saved model instances back into the database, with one UPDATE per batch.
+
+    Backport of QuerySet.bulk_update from Django 2.2. The Django version used by IL2 stats does not have it yet.
+
+    @param model Model class of the instances.
+    @param objs Saved instances of model.
+    @param fields Names of the fields which are to be written.
+    @param batch_size How many instances are written per UPDATE statement.
+    """
+    objs = list(objs)
+    fields = [model._meta.get_field(name) for name in fields]
+    for start in range(0, len(objs), batch_size):
+        batch = objs[start:start + batch_size]
+        updates = dict()
+        for field in fields:
+            whens = [When(pk=obj.pk, then=Value(getattr(obj, field.attname), output_field=field)) for obj in batch]
+            # PostgreSQL can not infer the type of a CASE with only parameters in it, hence the cast.
+            updates[field.attname] = Cast(Case(*whens, output_field=field), field)
+        model.objects.filter(pk__in=[obj.pk for obj in batch]).update(**updates)
+
+
+def copy_update(model, objs, fields):
+    """
+    Same as bulk_update, but streams the values into a staging table with COPY, and writes them with a single
+    UPDATE ... FROM staging. Meant for bulk loads of thousands of instances, see StatsUnitOfWork.bulk_load.
+    """
+    objs = list(objs)
+    if not objs:
+        return
+
+    def column(name):
+        return connection.ops.quote_name(model._meta.get_field(name).column)
+
+    table = connection.ops.quote_name(model._meta.db_table)
+    names = [model._meta.pk.name] + list(fields)
+    attnames = [model._meta.get_field(name).attname for name in names]
+    # Rows are locked in id order, so that concurrent updates can not deadlock each other.
+    rows = sorted([tuple(getattr(obj, attname) for attname in attnames) for obj in objs])
+    with connection.cursor() as cursor, __staging(cursor, model, names, rows) as staging:
+        cursor.execute('UPDATE {table} SET {updates} FROM {staging} WHERE {table}.{pk} = {staging}.{pk}'.format(
+            table=table,
+            staging=staging,
+            updates=', '.join('{col} = {staging}.{col}'.format(col=column(name), staging=staging) for name in fields),
+            pk=column(model._meta.pk.name),
+        ))
+
+
+def upsert_increment(model, key_fields, increment_fields, rows, overwrite_fields=(), copy=False):
+    """
+    Inserts the rows, or adds them onto the rows with the same key which already exist. One statement in total:
+
+    INSERT ... ON CONFLICT (key_fields) DO UPDATE SET f = table.f + EXCLUDED.f for f in increment_fields
+
+    A unique constraint on key_fields is required. Since the increments happen inside the database, several processes
+    can apply their rows at the same time without losing updates.
+
+    @param model Model class of the table.
+    @param key_fields Names of the fields of the unique constraint.
+    @param increment_fields Names of the counter fields which are added onto existing rows.
+    @param rows Tuples with the values of key_fields, then increment_fields, then overwrite_fields.
+                No two rows may have the same key.
+    @param overwrite_fields Names of the fields which are set to the new value on existing rows.
+    @param copy Whether the rows are streamed with COPY into a staging table first. Faster for thousands of rows.
+    """
+    updates = [(name, '{col} = {table}.{col} + EXCLUDED.{col}') for name in increment_fields]
+    updates += [(name, '{col} = EXCLUDED.{col}') for name in overwrite_fields]
+    __upsert(model, key_fields, updates, rows, copy)
+
+
+def upsert_flags(model, key_fields, flag_fields, rows, overwrite_fields=(), copy=False):
+    """
+    Inserts the rows, or sets the flags which are True in them on the rows with the same key which already exist.
+    Flags which are False in a row keep their value in the existing row. One statement in total.
+
+    @param model Model class of the table.
+    @param key_fields Names of the fields of the unique constraint.
+    @param flag_fields Names of the boolean fields.
+    @param rows Tuples with the values of key_fields, then flag_fields, then overwrite_fields.
+                No two rows may have the same key.
+    @param overwrite_fields Names of the fields which are set to the new value on existing rows.
+    @param copy See upsert_increment.
+    """
+    updates = [(name, '{col} = {table}.{col} OR EXCLUDED.{col}') for name in flag_fields]
+    updates += [(name, '{col} = EXCLUDED.{col}') for name in overwrite_fields]
+    __upsert(model, key_fields, updates, rows, copy)
+
+
+def insert_ignore(model, fields, rows, copy=False):
+    """
+    Inserts the rows, except those which conflict with a row which already exists. One statement in total:
+
+    INSERT ... ON CONFLICT DO NOTHING
+
+    @param model Model class of the table.
+    @param fields Names of the fields of the rows.
+    @param rows Tuples with the values of fields.
+    @param copy See upsert_increment.
+    """
+    if not rows:
+        return
+
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns = [connection.ops.quote_name(model._meta.get_field(name).column) for name in fields]
+    with connection.cursor() as cursor, __rows_source(cursor, model, fields, sorted(rows), copy) as (source, params):
+        cursor.execute('INSERT INTO {table} ({columns}) {source} ON CONFLICT DO NOTHING'.format(
+            table=table,
+            columns=', '.join(columns),
+            source=source,
+        ), params)
+
+
+def __upsert(model, key_fields, updates, rows, copy=False):
+    """
+    @param updates Pairs of field name and the SET clause for it, formatted with the quoted table and column.
+    """
+    if not rows:
+        return
+
+    def column(name):
+        return connection.ops.quote_name(model._meta.get_field(name).column)
+
+    table = connection.ops.quote_name(model._meta.db_table)
+    names = list(key_fields) + [name for name, _ in updates]
+    columns = [column(name) for name in names]
+
+    # Rows are locked in key order, so that concurrent upserts can not deadlock each other.
+    rows = sorted(rows, key=lambda row: row[:len(key_fields)])
+    with connection.cursor() as cursor, __rows_source(cursor, model, names, rows, copy) as (source, params):
+        cursor.execute('INSERT INTO {table} ({columns}) {source} ON CONFLICT ({keys}) DO UPDATE SET {updates}'.format(
+            table=table,
+            columns=', '.join(columns),
+            source=source,
+            keys=', '.join(columns[:len(key_fields)]),
+            updates=', '.join(template.format(table=table, col=column(name)) for name, template in updates),
+        ), params)
+
+
+@contextmanager
+def __rows_source(cursor, model, names, rows, copy):
+    """
+    Yields the source of an INSERT of the rows, and its parameters: Either a VALUES list, or a SELECT from a staging
+    table which the rows were copied into. The rows keep their order.
+    """
+    if not copy:
+        placeholder = '({})'.format(', '.join(['%s'] * len(names)))
+        yield 'VALUES ' + ', '.join([placeholder] * len(rows)), [value for row in rows for value in row]
+        return
+
+    with __staging(cursor, model, names, rows, ordered=True) as staging:
+        yield 'SELECT {columns} FROM {staging} ORDER BY ordinal'.format(
+            columns=', '.join(connection.ops.quote_name(model._meta.get_field(name).column) for name in names),
+            staging=staging,
+        ), []
+
+
+@contextmanager
+def __staging(cursor, model, names, rows, ordered=False):
+    """
+    Creates a temporary staging table with the columns of the given fields, streams the rows into it with COPY FROM
+    STDIN, and yields its name. The table is dropped afterwards.
+
+    @param ordered Whether the staging table gets an ordinal column, with the position of each row.
+    """
+    fields = [model._meta.get_field(name) for name in names]
+    staging = connection.ops.quote_name('staging_' + model._meta.db_table)
+    columns = ['{} {}'.format(connection.ops.quote_name(field.column), field.rel_db_type(connection))
+               for field in fields]
+    if ordered:
+        columns.insert(0, 'ordinal serial')
+    cursor.execute('CREATE TEMP TABLE {staging} ({columns})'.format(staging=staging, columns=', '.join(columns)))
+    try:
+        data = io.StringIO()
+        # Strings are quoted, so that COPY only reads the unquoted empty values of None as NULL.
+        writer = csv.writer(data, quoting=csv.QUOTE_NONNUMERIC)
+        for row in rows:
+            writer.writerow([json.dumps(value) if isinstance(value, (dict, list)) else value for value in row])
+        data.seek(0)
+        cursor.copy_expert('COPY {staging} ({columns}) FROM STDIN WITH (FORMAT csv)'.format(
+            staging=staging,
+            columns=', '.join(connection.ops.quote_name(field.column) for field in fields),
+        ), data)
+        yield staging
+    finally:
+        cursor.execute('DROP TABLE IF EXISTS {staging}'.format(staging=staging))
+
+
+def update_if_greater(model, key_fields, field, other_fields, rows, null_fields=()):
+    """
+    Sets field and other_fields on the rows with the given keys, but only where the new value of field is greater than
+    the stored one. One statement in total:
+
+    UPDATE ... SET field = v.field, ... FROM (VALUES ...) v WHERE (key_fields match) AND table.field < v.field
+
+    Since the comparison happens inside the database, a stored value is never replaced by a lower one, even if several
+    processes update the same rows at the same time.
+
+    @param model Model class of the table.
+    @param key_fields Names of the fields which identify the rows.
+    @param field Name of the field which is compared.
+    @param other_fields Names of the fields which are set along with field.
+    @param rows Tuples with the values of key_fields, then field, then other_fields. No two rows may have the same key.
+    @param null_fields Names of the fields which must be NULL on the updated rows.
+    """
+    if not rows:
+        return
+
+    def column(name):
+        return connection.ops.quote_name(model._meta.get_field(name).column)
+
+    table = connection.ops.quote_name(model._meta.db_table)
+    names = list(key_fields) + [field] + list(other_fields)
+    aliases = ['v{}'.format(i) for i in range(len(names))]
+
+    conditions = ['{table}.{col} = v.{alias}'.format(table=table, col=column(name), alias=alias)
+                  for name, alias in zip(key_fields, aliases)]
+    conditions += ['{table}.{col} IS NULL'.format(table=table, col=column(name)) for name in null_fields]
+    conditions.append('{table}.{col} < v.{alias}'.format(table=table, col=column(field),
+                                                          alias=aliases[len(key_fields)]))
+
+    # Rows are locked in key order, so that concurrent updates can not deadlock each other.
+    rows = sorted(rows, key=lambda row: tuple((value is None, value) for value in row[:len(key_fields)]))
+    # PostgreSQL can not infer the types of the columns of a VALUES list with only parameters, hence the casts. Without
+    # them, a column with only NULLs would be text.
+    placeholder = '({})'.format(', '.join('CAST(%s AS {})'.format(model._meta.get_field(name).db_type(connection))
+                                          for name in names))
+    sql = 'UPDATE {table} SET {updates} FROM (VALUES {values}) AS v ({aliases}) WHERE {conditions}'.format(
+        table=table,
+        updates=', '.join('{col} = v.{alias}'.format(col=column(name), alias=alias)
+                          for name, alias in zip(names[len(key_fields):], aliases[len(key_fields):])),
+        values=', '.join([placeholder] * len(rows)),
+        aliases=', '.join(aliases),
+        conditions=' AND '.join(conditions),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [value for row in rows for value in row])
+
+
+def update_increment(model, key_fields, increment_fields, rows):
+    """
+    Adds values onto the fields of existing rows, one statement in total:
+
+    UPDATE ... SET field = table.field + v.field, ... FROM (VALUES ...) v WHERE (key_fields match) RETURNING id
+
+    Unlike upsert_increment, keys without a row are skipped, and no unique constraint is needed. A NULL key field
+    matches NULL.
+
+    @param model Model class of the table.
+    @param key_fields Names of the fields which identify the rows.
+    @param increment_fields Names of the fields which are added onto.
+    @param rows Tuples with the values of key_fields, then increment_fields. No two rows may have the same key.
+    @returns Ids of the updated rows.
+    """
+    if not rows:
+        return []
+
+    def column(name):
+        return connection.ops.quote_name(model._meta.get_field(name).column)
+
+    table = connection.ops.quote_name(model._meta.db_table)
+    names = list(key_fields) + list(increment_fields)
+    aliases = ['v{}'.format(i) for i in range(len(names))]
+
+    # Rows are locked in key order, so that concurrent updates can not deadlock each other.
+    rows = sorted(rows, key=lambda row: tuple((value is None, value) for value in row[:len(key_fields)]))
+    # PostgreSQL can not infer the types of the columns of a VALUES list with only parameters, hence the casts.
+    placeholder = '({})'.format(', '.join('CAST(%s AS {})'.format(model._meta.get_field(name).db_type(connection))
+                                          for name in names))
+    sql = ('UPDATE {table} SET {updates} FROM (VALUES {values}) AS v ({aliases}) WHERE {conditions} '
+           'RETURNING {table}.{pk}').format(
+        table=table,
+        updates=', '.join('{col} = {table}.{col} + v.{alias}'.format(table=table, col=column(name), alias=alias)
+                          for name, alias in zip(names[len(key_fields):], aliases[len(key_fields):])),
+        values=', '.join([placeholder] * len(rows)),
+        aliases=', '.join(aliases),
+        conditions=' AND '.join('({table}.{col} = v.{alias} OR ({table}.{col} IS NULL AND v.{alias} IS NULL))'
+                                .format(table=table, col=column(name), alias=alias)
+                                for name, alias in zip(key_fields, aliases)),
+        pk=column(model._meta.pk.name),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [value for row in rows for value in row])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def fetch_or_create(model, key_fields, objs):
+    """
+    Fetches the rows with the keys of the unsaved instances objs, and inserts the instances whose key has no row yet.
+    One statement in total:
+
+    WITH k AS (VALUES ...), i AS (INSERT ... SELECT * FROM k ON CONFLICT DO NOTHING RETURNING *)
+    SELECT * FROM i UNION ALL SELECT table.* FROM table JOIN k ON (key_fields match)
+
+    Unique constraints on key_fields are required, a NULL key field matches NULL. Unlike get_or_create, two processes
+    can not create the same row twice. A row inserted by a concurrent transaction during the statement is not seen by
+    it, such keys are fetched again.
+
+    @param model Model class of the table.
+    @param key_fields Names of the fields which identify the rows.
+    @param objs Unsaved instances of model, each with a different key.
+    @returns Dict from the tuple of the key field values (attnames) to the saved instance.
+    """
+    def column(name):
+        return connection.ops.quote_name(model._meta.get_field(name).column)
+
+    table = connection.ops.quote_name(model._meta.db_table)
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+    columns = [connection.ops.quote_name(field.column) for field in fields]
+    key_attnames = [model._meta.get_field(name).attname for name in key_fields]
+    result = dict()
+    while objs:
+        # Rows are inserted in key order, so that concurrent inserts can not deadlock each other.
+        objs = sorted(objs, key=lambda obj: tuple((getattr(obj, name) is None, getattr(obj, name))
+                                                  for name in key_attnames))
+        # PostgreSQL can not infer the types of the columns of a VALUES list with only parameters, hence the casts.
+        placeholder = '({})'.format(', '.join('CAST(%s AS {})'.format(field.db_type(connection)) for field in fields))
+        sql = ('WITH k ({columns}) AS (VALUES {values}), '
+               'i AS (INSERT INTO {table} ({columns}) SELECT * FROM k ON CONFLICT DO NOTHING RETURNING *) '
+               'SELECT * FROM i UNION ALL SELECT {table}.* FROM {table} JOIN k ON {conditions}').format(
+            table=table,
+            columns=', '.join(columns),
+            values=', '.join([placeholder] * len(objs)),
+            conditions=' AND '.join('({table}.{col} = k.{col} OR ({table}.{col} IS NULL AND k.{col} IS NULL))'
+                                    .format(table=table, col=column(name)) for name in key_fields),
+        )
+        params = [field.get_db_prep_save(getattr(obj, field.attname), connection) for obj in objs for field in fields]
+        for row in model.objects.raw(sql, params):
+            result[tuple(getattr(row, name) for name in key_attnames)] = row
+        objs = [obj for obj in objs if tuple(getattr(obj, name) for name in key_attnames) not in result]
+    return result
+
+
+# Key of the PostgreSQL advisory locks taken by lock_aircraft_stats. The lock of a tour has the tour id as second key.
+AIRCRAFT_STATS_LOCK = 4702163
+
+
+def lock_aircraft_stats(exclusive=False, tour_ids=()):
+    """
+    Takes advisory locks on the aircraft stats until the end of the current transaction.
+
+    The buckets are read, changed in Python, and written back whole. So two transactions must never change the buckets
+    of the same tour at the same time, otherwise the later commit overwrites the changes of the earlier one. Everything
+    which writes the stats takes the lock of the aircraft stats shared, and the locks of the tours it writes exclusive.
+    The retro compute workers still run alongside each other, since each of them works on another tour.
+    targeted_recompute and retract_mission take the lock of the aircraft stats exclusive, so that everyone else waits
+    for them, and they wait for everyone else.
+
+    The locks are always taken in the same order, the aircraft stats first, then the tours by id, so that they can not
+    deadlock.
+
+    @param exclusive Whether no one else may hold the lock of the aircraft stats.
+    @param tour_ids Ids of the tours whose buckets are written.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT {}(%s)'.format('pg_advisory_xact_lock' if exclusive else 'pg_advisory_xact_lock_shared'),
+                       [AIRCRAFT_STATS_LOCK])
+        for tour_id in sorted(set(tour_ids)):
+            cursor.execute('SELECT pg_advisory_xact_lock(%s, %s)', [AIRCRAFT_STATS_LOCK, tour_id])
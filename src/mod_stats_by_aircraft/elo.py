@@ -0,0 +1,133 @@
+K_FACTOR = 15  # Low k factor (in chess ~30 is common), because there will be a lot of engagements.
+
+# How an encounter updates the ratings, depending on which of the two aircraft have subtypes. See update_elo.
+DIRECT = 'direct'
+LOSER_HALVED = 'loser_halved'
+SUBTYPE_VS_LOSER_MAIN = 'subtype_vs_loser_main'
+MAIN_VS_MAIN = 'main_vs_main'
+WINNER_HALVED = 'winner_halved'
+
+
+def update_elo(uow, tik, bucket, enemy_sortie_type, has_subtype, is_subtype, shotdown_enemy, subtype_enemy_bucket):
+    """
+    Records the Elo encounter of bucket shooting down an enemy in uow. The Elo of the buckets is updated when uow is
+    flushed, see EloBatch. Note that Elo is zero-sum, thus two buckets must always be updated.
+
+    There are in essence three cases for the Elo Update:
+
+    Aircraft 1 and Aircraft 2 have no subtypes -> Just update elo directly.
+    Aircraft 1 and 2 have subtypes: Main types update each other. Subtypes update each other.
+    Aircraft 1 has subtypes, Aircraft 2 does not:
+    Aircraft 1 main type and subtype updates directly from Aircraft 2 only type
+    Aircraft 2 has "half an encounter" with aircraft 1 main type, and "half an encounter" with aircraft 1 subtype.
+
+    @param tik Tik of the shotdown event. The encounters of a batch are applied in the order of their tiks.
+    """
+    if enemy_sortie_type == bucket.NO_FILTER:  # No subtypes for enemy
+        if not has_subtype:
+            uow.elo(tik, DIRECT, bucket, subtype_enemy_bucket)
+        else:
+            uow.elo(tik, LOSER_HALVED, bucket, subtype_enemy_bucket)
+    else:  # Enemy has subtypes
+        enemy_bucket = uow.bucket(bucket.tour, shotdown_enemy[0], bucket.NO_FILTER)
+
+        if has_subtype:
+            if is_subtype:
+                uow.elo(tik, SUBTYPE_VS_LOSER_MAIN, bucket, subtype_enemy_bucket, enemy_bucket)
+            else:
+                uow.elo(tik, MAIN_VS_MAIN, bucket, enemy_bucket)
+        else:
+            uow.elo(tik, WINNER_HALVED, bucket, subtype_enemy_bucket, enemy_bucket)
+
+
+class EloEncounter:
+    def __init__(self, tik, order, relation, winner, loser, loser_main=None):
+        self.tik = tik
+        # Breaks ties between encounters with the same tik, in the order they were recorded.
+        self.order = order
+        self.relation = relation
+        self.winner = winner
+        self.loser = loser
+        self.loser_main = loser_main
+
+
+class EloBatch:
+    """
+    Collects the Elo encounters of a mission, and applies them all at once in the order of their tiks.
+
+    Before, Elo was updated right away while processing each sortie, so the order of the updates depended on the
+    order of the sorties instead of the order of the shotdowns. The ratings are now updated in a plain list, and only
+    the final ratings are set on the buckets.
+    """
+
+    def __init__(self):
+        self.encounters = []
+
+    def add(self, tik, relation, winner, loser, loser_main=None):
+        self.encounters.append(EloEncounter(tik, len(self.encounters), relation, winner, loser, loser_main))
+
+    def apply(self):
+        """
+        Applies the encounters onto the elo of their buckets, then forgets them.
+        """
+        buckets = []
+        ratings = []
+        slots = dict()
+
+        def slot(bucket):
+            if id(bucket) not in slots:
+                slots[id(bucket)] = len(buckets)
+                buckets.append(bucket)
+                ratings.append(bucket.elo)
+            return slots[id(bucket)]
+
+        for encounter in sorted(self.encounters, key=lambda e: (e.tik, e.order)):
+            winner = slot(encounter.winner)
+            loser = slot(encounter.loser)
+            loser_main = slot(encounter.loser_main) if encounter.loser_main is not None else None
+            self.__apply(ratings, encounter.relation, winner, loser, loser_main)
+
+        for bucket, rating in zip(buckets, ratings):
+            bucket.elo = rating
+        self.encounters = []
+
+    @staticmethod
+    def __apply(ratings, relation, winner, loser, loser_main):
+        """
+        @param ratings List of ratings, indexed by the other parameters.
+        """
+        if relation == DIRECT or relation == MAIN_VS_MAIN:
+            ratings[winner], ratings[loser] = calc_elo(ratings[winner], ratings[loser])
+        elif relation == LOSER_HALVED:
+            ratings[winner], new_elo = calc_elo(ratings[winner], ratings[loser])
+            delta_elo = new_elo - ratings[loser]  # This is negative!
+            # This elo will be touched twice: once in subtype, once in not-filtered type.
+            # Hence take (approximately) the average delta.
+            ratings[loser] += round(delta_elo / 2)
+        elif relation == SUBTYPE_VS_LOSER_MAIN:
+            ratings[winner], ratings[loser] = calc_elo(ratings[winner], ratings[loser_main])
+        elif relation == WINNER_HALVED:
+            old_elo = ratings[winner]
+            first_new_elo, ratings[loser_main] = calc_elo(old_elo, ratings[loser_main])
+            second_new_elo, ratings[loser] = calc_elo(old_elo, ratings[loser])
+
+            first_delta_elo = first_new_elo - old_elo
+            second_delta_elo = second_new_elo - old_elo
+            ratings[winner] = round(old_elo + first_delta_elo / 2 + second_delta_elo / 2)
+
+
+def calc_elo(winner_rating, loser_rating):
+    """
+    From https://github.com/ddm7018/Elo
+    """
+    k = K_FACTOR
+    # k factor is the largest amount elo can shift. So a plane gains/loses at most k = 15 per engagement.
+    result = expected_result(winner_rating, loser_rating)
+    new_winner_rating = winner_rating + k * (1 - result)
+    new_loser_rating = loser_rating + k * (0 - (1 - result))
+    return int(round(new_winner_rating)), int(round(new_loser_rating))
+
+
+def expected_result(p1, p2):
+    exp = (p2 - p1) / 400.0
+    return 1 / ((10.0 ** exp) + 1)
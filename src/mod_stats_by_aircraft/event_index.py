@@ -0,0 +1,228 @@
+from collections import defaultdict
+
+from django.db.models import Q
+
+from stats.models import LogEntry
+from .aircraft_mod_models import SortieAugmentation
+from .object_catalog import get_object_catalog, turret_aircraft
+from .sortie_loader import unused_sortie_columns
+from .variant_utils import FILTER_TYPE_ATTRIBUTE
+
+# All LogEntry types which are read while computing aircraft stats.
+INDEXED_EVENT_TYPES = ['shotdown', 'killed', 'damaged', 'wounded', 'destroyed', 'takeoff']
+ENCOUNTER_TYPES = {'shotdown', 'killed', 'damaged'}
+LOSS_TYPES = {'shotdown', 'killed', 'destroyed'}
+
+
+def _base_query():
+    return (LogEntry.objects
+            .select_related('act_sortie', 'cact_sortie')
+            .defer(*unused_sortie_columns('act_sortie__'), *unused_sortie_columns('cact_sortie__'))
+            .filter(type__in=INDEXED_EVENT_TYPES)
+            .order_by('id'))
+
+
+class TurretHit:
+    """
+    What the turrets of an aircraft did to a sortie.
+    """
+
+    def __init__(self, aircraft):
+        self.aircraft = aircraft
+        self.damaged = False
+        self.killed = False
+        # Tik of the first shotdown by the turret, None if the turret did not shoot the sortie down.
+        self.shotdown_tik = None
+
+
+class MissionEventIndex:
+    """
+    In memory index of the LogEntry events needed to compute aircraft stats, keyed by act_sortie_id and
+    cact_sortie_id.
+
+    Before, every sortie ran its own set of LogEntry queries (takeoffs, attacker events, turret events, AA/accident
+    deaths, ammo breakdown sources, pilot snipes), once for the global buckets and once more for the player buckets.
+    The index loads all of these events in one query instead, and answers the same questions from memory.
+    """
+
+    def __init__(self, events, sorties=()):
+        self.sorties = {sortie.id: sortie for sortie in sorties}
+        self.by_act_sortie = defaultdict(list)
+        self.by_cact_sortie = defaultdict(list)
+
+        catalog = get_object_catalog()
+        for event in events:
+            # Objects are taken from the catalog instead of being joined into every event.
+            if event.act_object_id is not None:
+                event.act_object = catalog.object(event.act_object_id)
+            if event.cact_object_id is not None:
+                event.cact_object = catalog.object(event.cact_object_id)
+
+            # Share a single Sortie instance per id, so that any work cached on a sortie is done once.
+            if event.act_sortie_id is not None:
+                event.act_sortie = self.sorties.setdefault(event.act_sortie_id, event.act_sortie)
+                self.by_act_sortie[event.act_sortie_id].append(event)
+            if event.cact_sortie_id is not None:
+                event.cact_sortie = self.sorties.setdefault(event.cact_sortie_id, event.cact_sortie)
+                self.by_cact_sortie[event.cact_sortie_id].append(event)
+
+        self._load_filter_types()
+        # Computed by the first call to turret_hits.
+        self._turret_hits = None
+
+    def _load_filter_types(self):
+        """
+        Loads the stored filter types of the indexed sorties, so that get_sortie_type does not classify them again.
+        """
+        unclassified = [sortie_id for sortie_id, sortie in self.sorties.items()
+                        if getattr(sortie, FILTER_TYPE_ATTRIBUTE, None) is None]
+        if not unclassified:
+            return
+        stored = (SortieAugmentation.objects
+                  .filter(sortie_id__in=unclassified, filter_type__isnull=False)
+                  .values_list('sortie_id', 'filter_type'))
+        for sortie_id, filter_type in stored:
+            setattr(self.sorties[sortie_id], FILTER_TYPE_ATTRIBUTE, filter_type)
+
+    @classmethod
+    def for_mission(cls, mission_id, sorties=()):
+        """
+        @param mission_id Mission whose events are to be indexed.
+        @param sorties Already loaded Sorties of the mission, these instances are reused in the index.
+        """
+        return cls(_base_query().filter(mission_id=mission_id), sorties)
+
+    @classmethod
+    def for_sortie(cls, sortie):
+        """
+        Index with only the events of a single sortie. Used when sorties are processed one at a time.
+        """
+        return cls(_base_query().filter(Q(act_sortie_id=sortie.id) | Q(cact_sortie_id=sortie.id)), [sortie])
+
+    def takeoff_count(self, sortie_id):
+        return sum(1 for event in self.by_act_sortie[sortie_id] if event.type == 'takeoff')
+
+    def air_encounters(self, sortie_id):
+        """
+        Shotdown/killed/damaged events where the sortie attacked an enemy player aircraft.
+        AI sorties and friendly fire incidents are disregarded.
+        """
+        result = []
+        for event in self.by_act_sortie[sortie_id]:
+            if event.type not in ENCOUNTER_TYPES or event.cact_sortie_id is None:
+                continue
+            if not _cls_base_is(event.act_object, 'aircraft') or not _cls_base_is(event.cact_object, 'aircraft'):
+                continue
+            if event.act_sortie.coalition == event.cact_sortie.coalition:
+                continue
+            result.append(event)
+        return result
+
+    def turret_encounters(self, sortie_id):
+        """
+        Shotdown/killed/damaged events where an aircraft turret hit the sortie's aircraft.
+
+        LogEntry does not store what your turrets did, only what turrets hit you. So these events are parsed from the
+        perspective of the turret's plane.
+        """
+        return [event for event in self.by_cact_sortie[sortie_id] if _is_turret_encounter(event)]
+
+    def turret_hits(self, sortie_id):
+        """
+        @returns TurretHits of the turrets which hit the sortie, one per turret name, in the order the turrets first hit
+                 it. Turrets whose aircraft is not supported are left out.
+        """
+        if self._turret_hits is None:
+            self._turret_hits = self._index_turret_hits()
+        return self._turret_hits.get(sortie_id, [])
+
+    def _index_turret_hits(self):
+        """
+        One pass over the turret encounters of all sorties, in which each turret is resolved to its aircraft once.
+        Before, every victim sortie looked its turrets up on its own, which made bomber heavy missions slow.
+        """
+        aircraft_of_turret = dict()
+        result = dict()
+        for sortie_id, events in self.by_cact_sortie.items():
+            hits = dict()
+            for event in events:
+                if not _is_turret_encounter(event):
+                    continue
+                turret_name = event.act_object.name
+                if turret_name not in hits:
+                    turret_key = (turret_name, event.act_object.log_name)
+                    if turret_key not in aircraft_of_turret:
+                        aircraft_of_turret[turret_key] = turret_aircraft(*turret_key)
+                    if aircraft_of_turret[turret_key] is None:
+                        continue
+                    hits[turret_name] = TurretHit(aircraft_of_turret[turret_key])
+                turret_hit = hits[turret_name]
+                if event.type == 'damaged':
+                    turret_hit.damaged = True
+                elif event.type == 'shotdown':
+                    if turret_hit.shotdown_tik is None:
+                        turret_hit.shotdown_tik = event.tik
+                elif event.type == 'killed':
+                    turret_hit.killed = True
+            if hits:
+                result[sortie_id] = list(hits.values())
+        return result
+
+    def loss_causes(self, sortie_id):
+        """
+        @returns The distinct act_object classes which shot down, killed or destroyed the sortie.
+                 None is contained if there was a loss event without an attacker.
+        """
+        return {event.act_object.cls if event.act_object else None
+                for event in self.by_cact_sortie[sortie_id] if event.type in LOSS_TYPES}
+
+    def damage_sources(self, sortie_id):
+        """
+        @returns The distinct (act_object, act_sortie) pairs of aircraft, vehicles, tanks and turrets which damaged the
+                 sortie, in order of their first occurrence. Damage from AI aircraft is disregarded.
+        """
+        result = []
+        seen = set()
+        for event in self.by_cact_sortie[sortie_id]:
+            if event.type not in ENCOUNTER_TYPES or event.act_object is None:
+                continue
+            act_object = event.act_object
+            if not (act_object.cls_base in ('aircraft', 'vehicle', 'turret') or 'tank' in act_object.cls):
+                continue
+            if act_object.cls_base == 'aircraft' and event.act_sortie_id is None:
+                continue
+            key = (act_object.id, event.act_sortie_id)
+            if key not in seen:
+                seen.add(key)
+                result.append((act_object, event.act_sortie))
+        return result
+
+    def attributed_events(self, sortie_id, event_type):
+        """
+        @returns Events of the given type which hit the sortie and have an attacking object, in order of occurrence.
+        """
+        return [event for event in self.by_cact_sortie[sortie_id]
+                if event.type == event_type and event.act_object_id is not None]
+
+
+def _is_turret_encounter(event):
+    if event.type not in ENCOUNTER_TYPES:
+        return False
+    if event.act_object is None or event.act_object.cls != 'aircraft_turret':
+        return False
+    if not _cls_base_is(event.cact_object, 'aircraft'):
+        return False
+    return (event.extra_data or {}).get('is_friendly_fire') is not True
+
+
+def _cls_base_is(db_object, cls_base):
+    return db_object is not None and db_object.cls_base == cls_base
+
+
+def get_event_index(sortie, event_index=None):
+    """
+    Returns event_index if one was passed in, otherwise an index for just this sortie.
+    """
+    if event_index is None:
+        return MissionEventIndex.for_sortie(sortie)
+    return event_index
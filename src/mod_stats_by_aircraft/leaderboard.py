@@ -0,0 +1,51 @@
+from .aircraft_mod_models import AircraftBucket
+from .db_utils import update_if_greater
+
+LEADERBOARD_KEY = ['tour', 'aircraft', 'filter_type']
+# Record fields of the buckets without player, and the field with who holds the record.
+LEADERBOARD_FIELDS = [
+    ('max_score_streak', 'max_score_streak_player'),
+    ('max_ak_streak', 'max_ak_streak_player'),
+    ('max_gk_streak', 'max_gk_streak_player'),
+    ('best_score_in_sortie', 'best_score_sortie'),
+    ('best_ak_in_sortie', 'best_ak_sortie'),
+    ('best_gk_in_sortie', 'best_gk_sortie'),
+]
+LEADERBOARD_RECORD_FIELDS = [field for record in LEADERBOARD_FIELDS for field in record]
+
+
+class StreakLeaderboard:
+    """
+    The best streaks and sorties of the players, per (tour, aircraft, filter_type), which are the records of the
+    buckets without player.
+
+    Before, each player bucket compared its streaks with the bucket without player, and the records were written back
+    with that bucket. Now the best candidates are collected in memory, and flush raises the stored records with one
+    conditional UPDATE per record field. So a record is never lowered by a process which loaded it before another
+    process raised it.
+    """
+
+    def __init__(self):
+        # (record field, tour id, aircraft id, filter_type) -> (value, holder)
+        self.candidates = dict()
+
+    def offer(self, tour, aircraft, filter_type, field, value, holder):
+        """
+        Proposes holder (Player or Sortie) for the record field of the bucket without player. Among equal values, the
+        first one offered is kept, as is the stored record.
+        """
+        key = (field, tour.id, aircraft.id, filter_type)
+        if key not in self.candidates or value > self.candidates[key][0]:
+            self.candidates[key] = (value, holder)
+
+    def flush(self):
+        """
+        Raises the stored records which are beaten by a candidate, then forgets the candidates.
+        The buckets without player must already exist.
+        """
+        for field, holder_field in LEADERBOARD_FIELDS:
+            rows = [(tour_id, aircraft_id, filter_type, value, holder.id)
+                    for (record_field, tour_id, aircraft_id, filter_type), (value, holder) in self.candidates.items()
+                    if record_field == field]
+            update_if_greater(AircraftBucket, LEADERBOARD_KEY, field, [holder_field], rows, null_fields=['player'])
+        self.candidates.clear()
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from stats.models import Object
+from ...aircraft_mod_models import AircraftRetroChunk
+from ...background_jobs.background_job import get_tour_cutoff
+from ...targeted_recompute import recompute_aircraft
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the aircraft stats of one aircraft, e.g. after the variant rules of it changed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('aircraft_id', type=int, help='Object id of the aircraft.')
+
+    def handle(self, *args, **options):
+        aircraft_id = options['aircraft_id']
+        if not Object.objects.filter(id=aircraft_id, cls_base='aircraft').exists():
+            raise CommandError('There is no aircraft with the id {}.'.format(aircraft_id))
+        # The retro compute would process the sorties of the aircraft again after they were recomputed.
+        if AircraftRetroChunk.objects.exists():
+            raise CommandError('The retro compute queue has chunks left. Let retro_compute_aircraft_stats finish, or '
+                               'clear the queue with "python manage.py retro_compute_aircraft_stats --clear".')
+
+        tour_cutoff = get_tour_cutoff()
+        if tour_cutoff is None:
+            self.stdout.write('There are no tours to recompute.')
+            return
+        recompute_aircraft(aircraft_id, tour_cutoff)
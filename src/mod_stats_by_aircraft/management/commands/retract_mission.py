@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from stats.models import Mission
+from ...aircraft_mod_models import AircraftStatsContribution, AircraftStatsQueue
+from ...contributions import retract_mission
+
+
+class Command(BaseCommand):
+    help = 'Subtracts the aircraft stats which a mission added, e.g. after the mission was voided.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('mission_id', type=int, help='Id of the mission.')
+
+    def handle(self, *args, **options):
+        mission_id = options['mission_id']
+        if not Mission.objects.filter(id=mission_id).exists():
+            raise CommandError('There is no mission with the id {}.'.format(mission_id))
+        if AircraftStatsQueue.objects.filter(mission_id=mission_id).exists():
+            raise CommandError('The aircraft stats of mission {} are not computed yet, it is still queued.'
+                               .format(mission_id))
+        # Missions computed by the retroactive computations, or by a version of this mod before 1.6.0, have none.
+        contribution = AircraftStatsContribution.objects.filter(mission_id=mission_id).first()
+        if contribution is None:
+            raise CommandError('Mission {} has no contribution record, so its aircraft stats can not be retracted. '
+                               'Missions computed by the retroactive computations or before version 1.6.0 of this '
+                               'mod have none.'.format(mission_id))
+        if contribution.retracted or not retract_mission(mission_id):
+            raise CommandError('Mission {} was retracted already.'.format(mission_id))
+        self.stdout.write('Retracted the aircraft stats of mission {}.'.format(mission_id))
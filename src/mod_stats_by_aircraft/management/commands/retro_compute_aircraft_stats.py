@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from ...background_jobs.retro_work_queue import run_retro_workers, clear_retro_queue
+
+
+class Command(BaseCommand):
+    help = 'Retroactively computes the aircraft stats with several worker processes, e.g. after an update of the mod.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=4, help='Number of worker processes.')
+        parser.add_argument('--clear', action='store_true',
+                            help='Only remove the chunks left in the queue by a run which was killed.')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            self.stdout.write('Removed {} chunks from the retro compute queue.'.format(clear_retro_queue()))
+            return
+        run_retro_workers(max(1, options['processes']))
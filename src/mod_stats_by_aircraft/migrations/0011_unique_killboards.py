@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# Merges killboards which were created twice for the same pair of buckets, so that the unique constraint can be added.
+# The counters are summed into the oldest row. A merged row is only marked as reset if all of its parts were.
+MERGE_DUPLICATE_KILLBOARDS = '''
+UPDATE "AircraftKillboard_MOD_STATS_BY_AIRCRAFT" AS kb SET
+    aircraft_1_kills = d.aircraft_1_kills,
+    aircraft_1_shotdown = d.aircraft_1_shotdown,
+    aircraft_1_assists = d.aircraft_1_assists,
+    aircraft_1_pk_assists = d.aircraft_1_pk_assists,
+    aircraft_2_kills = d.aircraft_2_kills,
+    aircraft_2_shotdown = d.aircraft_2_shotdown,
+    aircraft_2_assists = d.aircraft_2_assists,
+    aircraft_2_pk_assists = d.aircraft_2_pk_assists,
+    aircraft_1_distinct_hits = d.aircraft_1_distinct_hits,
+    aircraft_2_distinct_hits = d.aircraft_2_distinct_hits,
+    reset_kills_turret_bug = d.reset_kills_turret_bug,
+    reset_player_loses = d.reset_player_loses
+FROM (
+    SELECT MIN(id) AS id,
+           SUM(aircraft_1_kills) AS aircraft_1_kills,
+           SUM(aircraft_1_shotdown) AS aircraft_1_shotdown,
+           SUM(aircraft_1_assists) AS aircraft_1_assists,
+           SUM(aircraft_1_pk_assists) AS aircraft_1_pk_assists,
+           SUM(aircraft_2_kills) AS aircraft_2_kills,
+           SUM(aircraft_2_shotdown) AS aircraft_2_shotdown,
+           SUM(aircraft_2_assists) AS aircraft_2_assists,
+           SUM(aircraft_2_pk_assists) AS aircraft_2_pk_assists,
+           SUM(aircraft_1_distinct_hits) AS aircraft_1_distinct_hits,
+           SUM(aircraft_2_distinct_hits) AS aircraft_2_distinct_hits,
+           BOOL_AND(reset_kills_turret_bug) AS reset_kills_turret_bug,
+           BOOL_AND(reset_player_loses) AS reset_player_loses
+    FROM "AircraftKillboard_MOD_STATS_BY_AIRCRAFT"
+    GROUP BY aircraft_1_id, aircraft_2_id, tour_id
+    HAVING COUNT(*) > 1
+) AS d
+WHERE kb.id = d.id;
+
+DELETE FROM "AircraftKillboard_MOD_STATS_BY_AIRCRAFT" AS kb
+USING "AircraftKillboard_MOD_STATS_BY_AIRCRAFT" AS other
+WHERE kb.aircraft_1_id = other.aircraft_1_id
+  AND kb.aircraft_2_id = other.aircraft_2_id
+  AND kb.tour_id = other.tour_id
+  AND kb.id > other.id;
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mod_stats_by_aircraft', '0010_fix_rating_crash'),
+    ]
+
+    operations = [
+        migrations.RunSQL(MERGE_DUPLICATE_KILLBOARDS, migrations.RunSQL.noop),
+        migrations.AlterUniqueTogether(
+            name='aircraftkillboard',
+            unique_together=set([('aircraft_1', 'aircraft_2', 'tour')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mod_stats_by_aircraft', '0011_unique_killboards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sortieaugmentation',
+            name='filter_type',
+            field=models.CharField(choices=[('NO_FILTER', 'no filter'), ('NO_BOMBS_JUICE', 'no bombs nor juice'), ('BOMBS', 'bomb sorties only with no juice'), ('JUICE', 'juiced (upgraded engine/fuel)'), ('ALL', 'all')], db_index=True, default=None, max_length=16, null=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0036_pt_br'),
+        ('mod_stats_by_aircraft', '0012_sortie_filter_type'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AircraftStatsQueue',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('enqueued_at', models.DateTimeField(auto_now_add=True)),
+                ('mission', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='stats.Mission')),
+            ],
+            options={
+                'db_table': 'AircraftStatsQueue_MOD_STATS_BY_AIRCRAFT',
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 12:00
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0036_pt_br'),
+        ('mod_stats_by_aircraft', '0013_aircraft_stats_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AircraftStatsContribution',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('buckets', django.contrib.postgres.fields.jsonb.JSONField(default=list)),
+                ('killboards', django.contrib.postgres.fields.jsonb.JSONField(default=list)),
+                ('retracted', models.BooleanField(default=False)),
+                ('mission', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='stats.Mission')),
+            ],
+            options={
+                'db_table': 'AircraftStatsContribution_MOD_STATS_BY_AIRCRAFT',
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0036_pt_br'),
+        ('mod_stats_by_aircraft', '0014_aircraft_stats_contribution'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AircraftBucketMembership',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='mod_stats_by_aircraft.AircraftBucket')),
+                ('sortie', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='stats.Sortie')),
+            ],
+            options={
+                'db_table': 'AircraftBucketMembership_MOD_STATS_BY_AIRCRAFT',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='aircraftbucketmembership',
+            unique_together=set([('sortie', 'bucket')]),
+        ),
+    ]
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations, transaction
+
+BUCKETS = '"AircraftBucket_MOD_STATS_BY_AIRCRAFT"'
+KILLBOARDS = '"AircraftKillboard_MOD_STATS_BY_AIRCRAFT"'
+MEMBERSHIPS = '"AircraftBucketMembership_MOD_STATS_BY_AIRCRAFT"'
+
+# Counters which are summed up over the duplicates. Kept here, so that later changes to the models don't change this.
+COUNTER_COLUMNS = [
+    'total_sorties', 'total_flight_time', 'kills', 'ground_kills', 'assists', 'score', 'aircraft_lost', 'deaths',
+    'captures', 'bailouts', 'ditches', 'landings', 'in_flight', 'crashes', 'shotdown',
+    'deaths_to_accident', 'deaths_to_aa', 'aircraft_lost_to_accident', 'aircraft_lost_to_aa',
+    'ammo_shot', 'ammo_hit', 'bomb_rocket_shot', 'bomb_rocket_hit',
+    'sorties_plane_was_hit', 'plane_survivability_counter', 'pilot_survivability_counter',
+    'plane_lethality_counter', 'pilot_lethality_counter', 'distinct_enemies_hit', 'pilot_kills',
+]
+STREAK_COLUMNS = ['current_score_streak', 'current_ak_streak', 'current_gk_streak']
+COUNTER_DICT_COLUMNS = ['killboard_planes', 'killboard_ground']
+# Records, and the column with who holds them.
+RECORD_COLUMNS = [
+    ('max_score_streak', 'max_score_streak_player_id'),
+    ('max_ak_streak', 'max_ak_streak_player_id'),
+    ('max_gk_streak', 'max_gk_streak_player_id'),
+    ('best_score_in_sortie', 'best_score_sortie_id'),
+    ('best_ak_in_sortie', 'best_ak_sortie_id'),
+    ('best_gk_in_sortie', 'best_gk_sortie_id'),
+]
+KILLBOARD_COUNTER_COLUMNS = [
+    ('aircraft_1_kills', 'aircraft_2_kills'),
+    ('aircraft_1_shotdown', 'aircraft_2_shotdown'),
+    ('aircraft_1_assists', 'aircraft_2_assists'),
+    ('aircraft_1_pk_assists', 'aircraft_2_pk_assists'),
+    ('aircraft_1_distinct_hits', 'aircraft_2_distinct_hits'),
+]
+KILLBOARD_FLAG_COLUMNS = ['reset_kills_turret_bug', 'reset_player_loses']
+
+# Buckets which were created twice for the same (tour, aircraft, filter_type, player), since get_or_create raced.
+# NULL players are grouped together by GROUP BY and PARTITION BY.
+FIND_DUPLICATE_TOURS = '''
+SELECT DISTINCT tour_id FROM {buckets}
+GROUP BY tour_id, aircraft_id, filter_type, player_id
+HAVING COUNT(*) > 1
+ORDER BY tour_id;
+'''.format(buckets=BUCKETS)
+
+# Every group of a tour is merged into its oldest bucket, the keeper. The groups are locked, so that the stats process
+# can't write to them while they are merged.
+FIND_DUPLICATES = '''
+CREATE TEMP TABLE bucket_groups ON COMMIT DROP AS
+SELECT keeper_id, id AS member_id FROM (
+    SELECT id, MIN(id) OVER (PARTITION BY tour_id, aircraft_id, filter_type, player_id) AS keeper_id,
+           COUNT(*) OVER (PARTITION BY tour_id, aircraft_id, filter_type, player_id) AS group_size
+    FROM {buckets}
+    WHERE tour_id = %(tour_id)s
+) AS b
+WHERE group_size > 1;
+
+SELECT id FROM {buckets} WHERE id IN (SELECT member_id FROM bucket_groups) ORDER BY id FOR UPDATE;
+
+CREATE TEMP TABLE bucket_duplicates ON COMMIT DROP AS
+SELECT keeper_id, member_id AS duplicate_id FROM bucket_groups WHERE member_id <> keeper_id;
+'''.format(buckets=BUCKETS)
+
+# The counters are summed up. Elo, coalition and the ammo breakdown of the keeper are kept.
+MERGE_COUNTERS = '''
+UPDATE {buckets} AS b SET {updates}
+FROM (
+    SELECT g.keeper_id, {aggregates}
+    FROM bucket_groups AS g JOIN {buckets} AS x ON x.id = g.member_id
+    GROUP BY g.keeper_id
+) AS d
+WHERE b.id = d.keeper_id;
+'''.format(
+    buckets=BUCKETS,
+    updates=', '.join('{col} = d.{col}'.format(col=col) for col in COUNTER_COLUMNS + STREAK_COLUMNS),
+    aggregates=', '.join(['SUM(x.{col}) AS {col}'.format(col=col) for col in COUNTER_COLUMNS]
+                         + ['MAX(x.{col}) AS {col}'.format(col=col) for col in STREAK_COLUMNS]),
+)
+
+MERGE_COUNTER_DICT = '''
+UPDATE {buckets} AS b SET {col} = d.counts
+FROM (
+    SELECT keeper_id, jsonb_object_agg(key, total) AS counts
+    FROM (
+        SELECT g.keeper_id, e.key, SUM(e.value::numeric) AS total
+        FROM bucket_groups AS g JOIN {buckets} AS x ON x.id = g.member_id, jsonb_each_text(x.{col}) AS e
+        GROUP BY g.keeper_id, e.key
+    ) AS s
+    GROUP BY keeper_id
+) AS d
+WHERE b.id = d.keeper_id;
+'''
+
+# The best record of a group wins, along with its holder.
+MERGE_RECORD = '''
+UPDATE {buckets} AS b SET {col} = d.{col}, {holder} = d.{holder}
+FROM (
+    SELECT DISTINCT ON (g.keeper_id) g.keeper_id, x.{col}, x.{holder}
+    FROM bucket_groups AS g JOIN {buckets} AS x ON x.id = g.member_id
+    ORDER BY g.keeper_id, x.{col} DESC, x.id
+) AS d
+WHERE b.id = d.keeper_id;
+'''
+
+# Killboards of the duplicates are moved to the keepers, and merged with the killboards the keepers already have.
+# The bucket with the lower id is aircraft_1. If the sides switch that way, so do the counters, unless both sides are
+# the same aircraft: then the stats code counted everything on the aircraft_1 side.
+MOVE_KILLBOARDS = '''
+CREATE TEMP TABLE killboards_moved ON COMMIT DROP AS
+SELECT kb.*,
+       COALESCE(d1.keeper_id, kb.aircraft_1_id) AS new_1_id,
+       COALESCE(d2.keeper_id, kb.aircraft_2_id) AS new_2_id,
+       b1.aircraft_id = b2.aircraft_id AS same_aircraft
+FROM {killboards} AS kb
+LEFT JOIN bucket_duplicates AS d1 ON d1.duplicate_id = kb.aircraft_1_id
+LEFT JOIN bucket_duplicates AS d2 ON d2.duplicate_id = kb.aircraft_2_id
+JOIN {buckets} AS b1 ON b1.id = kb.aircraft_1_id
+JOIN {buckets} AS b2 ON b2.id = kb.aircraft_2_id
+WHERE d1.duplicate_id IS NOT NULL OR d2.duplicate_id IS NOT NULL;
+
+DELETE FROM {killboards} WHERE id IN (SELECT id FROM killboards_moved);
+
+INSERT INTO {killboards} (aircraft_1_id, aircraft_2_id, tour_id, {counter_columns}, {flag_columns})
+SELECT LEAST(new_1_id, new_2_id), GREATEST(new_1_id, new_2_id), tour_id, {counter_sums}, {flag_ands}
+FROM killboards_moved
+GROUP BY LEAST(new_1_id, new_2_id), GREATEST(new_1_id, new_2_id), tour_id
+ON CONFLICT (aircraft_1_id, aircraft_2_id, tour_id) DO UPDATE SET {counter_updates}, {flag_updates};
+'''.format(
+    buckets=BUCKETS,
+    killboards=KILLBOARDS,
+    counter_columns=', '.join(col for pair in KILLBOARD_COUNTER_COLUMNS for col in pair),
+    flag_columns=', '.join(KILLBOARD_FLAG_COLUMNS),
+    counter_sums=', '.join(
+        'SUM(CASE WHEN new_1_id <= new_2_id OR same_aircraft THEN {this} ELSE {other} END)'.format(this=this,
+                                                                                                 other=other)
+        for col_1, col_2 in KILLBOARD_COUNTER_COLUMNS for this, other in ((col_1, col_2), (col_2, col_1))),
+    flag_ands=', '.join('BOOL_AND({col})'.format(col=col) for col in KILLBOARD_FLAG_COLUMNS),
+    counter_updates=', '.join('{col} = {killboards}.{col} + EXCLUDED.{col}'.format(col=col, killboards=KILLBOARDS)
+                              for pair in KILLBOARD_COUNTER_COLUMNS for col in pair),
+    flag_updates=', '.join('{col} = {killboards}.{col} AND EXCLUDED.{col}'.format(col=col, killboards=KILLBOARDS)
+                           for col in KILLBOARD_FLAG_COLUMNS),
+)
+
+DELETE_DUPLICATES = '''
+INSERT INTO {memberships} (sortie_id, bucket_id)
+SELECT m.sortie_id, d.keeper_id
+FROM {memberships} AS m JOIN bucket_duplicates AS d ON d.duplicate_id = m.bucket_id
+ON CONFLICT DO NOTHING;
+
+DELETE FROM {memberships} WHERE bucket_id IN (SELECT duplicate_id FROM bucket_duplicates);
+DELETE FROM {buckets} WHERE id IN (SELECT duplicate_id FROM bucket_duplicates);
+'''.format(buckets=BUCKETS, memberships=MEMBERSHIPS)
+
+# The derived fields of the keepers (kd, accuracy, ...) are refreshed the next time a sortie updates them.
+MERGE_DUPLICATE_BUCKETS = (
+    FIND_DUPLICATES
+    + MERGE_COUNTERS
+    + ''.join(MERGE_COUNTER_DICT.format(buckets=BUCKETS, col=col) for col in COUNTER_DICT_COLUMNS)
+    + ''.join(MERGE_RECORD.format(buckets=BUCKETS, col=col, holder=holder) for col, holder in RECORD_COLUMNS)
+    + MOVE_KILLBOARDS
+    + DELETE_DUPLICATES
+)
+
+
+def merge_duplicates(connection):
+    """
+    Merges the duplicate buckets tour by tour, each tour in its own transaction, so that the stats can still be written
+    meanwhile. Also run by 0017_unique_buckets right before each unique index is built.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(FIND_DUPLICATE_TOURS)
+        tour_ids = [row[0] for row in cursor.fetchall()]
+    for tour_id in tour_ids:
+        with transaction.atomic(using=connection.alias):
+            with connection.cursor() as cursor:
+                cursor.execute(MERGE_DUPLICATE_BUCKETS, {'tour_id': tour_id})
+
+
+def merge_duplicate_buckets(apps, schema_editor):
+    merge_duplicates(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+    # Each tour is merged in its own transaction, see merge_duplicates.
+    atomic = False
+
+    dependencies = [
+        ('mod_stats_by_aircraft', '0015_aircraft_bucket_membership'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_buckets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 12:00
+from __future__ import unicode_literals
+
+from importlib import import_module
+
+from django.db import migrations, IntegrityError
+
+merge_duplicates = import_module('.0016_merge_duplicate_buckets', __package__).merge_duplicates
+
+# A plain unique constraint on (tour, aircraft, filter_type, player) would allow any number of buckets without player,
+# since NULLs are never equal. Hence one partial unique index for the buckets with player, and one for those without.
+# The indexes are built concurrently, so that the stats can still be read and written meanwhile.
+UNIQUE_INDEXES = [
+    ('AircraftBucket_MOD_STATS_BY_AIRCRAFT_player_key',
+     'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS "AircraftBucket_MOD_STATS_BY_AIRCRAFT_player_key" '
+     'ON "AircraftBucket_MOD_STATS_BY_AIRCRAFT" (tour_id, aircraft_id, filter_type, player_id) '
+     'WHERE player_id IS NOT NULL'),
+    ('AircraftBucket_MOD_STATS_BY_AIRCRAFT_global_key',
+     'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS "AircraftBucket_MOD_STATS_BY_AIRCRAFT_global_key" '
+     'ON "AircraftBucket_MOD_STATS_BY_AIRCRAFT" (tour_id, aircraft_id, filter_type) '
+     'WHERE player_id IS NULL'),
+]
+
+FIND_INVALID_INDEX = '''
+SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid
+WHERE pg_class.relname = %s AND NOT pg_index.indisvalid
+'''
+
+# How often building an index is tried, if a stats process of the previous version creates duplicates meanwhile.
+ATTEMPTS = 5
+
+
+def create_unique_indexes(apps, schema_editor):
+    connection = schema_editor.connection
+    for name, create_index in UNIQUE_INDEXES:
+        for attempt in range(1, ATTEMPTS + 1):
+            # Duplicates may have been created since 0016_merge_duplicate_buckets.
+            merge_duplicates(connection)
+            with connection.cursor() as cursor:
+                # A failed CREATE INDEX CONCURRENTLY leaves an invalid index behind, which IF NOT EXISTS would keep.
+                cursor.execute(FIND_INVALID_INDEX, [name])
+                if cursor.fetchone():
+                    cursor.execute('DROP INDEX CONCURRENTLY IF EXISTS "{}"'.format(name))
+                try:
+                    cursor.execute(create_index)
+                    break
+                except IntegrityError:
+                    if attempt == ATTEMPTS:
+                        raise
+
+
+def drop_unique_indexes(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for name, _ in UNIQUE_INDEXES:
+            cursor.execute('DROP INDEX IF EXISTS "{}"'.format(name))
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction.
+    atomic = False
+
+    dependencies = [
+        ('mod_stats_by_aircraft', '0016_merge_duplicate_buckets'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_unique_indexes, drop_unique_indexes),
+    ]
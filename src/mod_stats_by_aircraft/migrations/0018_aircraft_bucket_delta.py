@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 12:00
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mod_stats_by_aircraft', '0017_unique_buckets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AircraftBucketDelta',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('changes', django.contrib.postgres.fields.jsonb.JSONField()),
+                ('bucket', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='mod_stats_by_aircraft.AircraftBucket')),
+            ],
+            options={
+                'db_table': 'AircraftBucketDelta_MOD_STATS_BY_AIRCRAFT',
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0036_pt_br'),
+        ('mod_stats_by_aircraft', '0018_aircraft_bucket_delta'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AircraftRetroChunk',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job', models.CharField(max_length=64)),
+                ('first_sortie_id', models.IntegerField()),
+                ('last_sortie_id', models.IntegerField()),
+                ('tour', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='stats.Tour')),
+            ],
+            options={
+                'db_table': 'AircraftRetroChunk_MOD_STATS_BY_AIRCRAFT',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='aircraftretrochunk',
+            index_together=set([('tour', 'id')]),
+        ),
+    ]
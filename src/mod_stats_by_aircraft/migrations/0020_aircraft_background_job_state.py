@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mod_stats_by_aircraft', '0019_aircraft_retro_chunk'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AircraftBackgroundJobState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job', models.CharField(max_length=64, unique=True)),
+                ('cursor_tour_id', models.IntegerField(null=True)),
+                ('cursor_sortie_id', models.IntegerField(null=True)),
+                ('sorties_left', models.IntegerField(null=True)),
+            ],
+            options={
+                'db_table': 'AircraftBackgroundJobState_MOD_STATS_BY_AIRCRAFT',
+            },
+        ),
+    ]
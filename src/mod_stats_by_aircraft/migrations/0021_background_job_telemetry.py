@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mod_stats_by_aircraft', '0020_aircraft_background_job_state'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='aircraftbackgroundjobstate',
+            options={'ordering': ['id']},
+        ),
+        migrations.AddField(
+            model_name='aircraftbackgroundjobstate',
+            name='batches',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='aircraftbackgroundjobstate',
+            name='sorties_processed',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='aircraftbackgroundjobstate',
+            name='wall_seconds',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='aircraftbackgroundjobstate',
+            name='db_seconds',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='aircraftbackgroundjobstate',
+            name='last_sorties_per_second',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='aircraftbackgroundjobstate',
+            name='last_batch_at',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mod_stats_by_aircraft', '0021_background_job_telemetry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aircraftbucket',
+            name='reset_lethality',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+        migrations.AddField(
+            model_name='aircraftkillboard',
+            name='reset_lethality',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+        migrations.AddField(
+            model_name='sortieaugmentation',
+            name='fixed_lethality',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+    ]
@@ -0,0 +1,150 @@
+import time
+
+from django.db.models import Count, Max
+
+from stats.logger import logger
+from stats.models import Object
+
+# How many seconds the catalog is trusted before checking whether the Object table changed.
+RECHECK_INTERVAL = 60
+
+TURRET_AMBIGUITIES = {
+    'Bristol',
+    'Halberstadt'
+}
+
+TURRET_TO_AIRCRAFT = {
+    'turretbristolf2b_1': 'Bristol F2B (F.II)',
+    'turretbristolf2bf2_1': 'Bristol F2B (F.II)',
+    'turretbristolf2bf2_1_wm2': 'Bristol F2B (F.II)',
+    'turretbristolf2bf2_1m': 'Bristol F2B (F.II)',
+    'turretbristolf2bf3_1': 'Bristol F2B (F.III)',
+    'turretbristolf2bf3_1_wm2': 'Bristol F2B (F.III)',
+    'turretbristolf2bf3_1m': 'Bristol F2B (F.III)',
+    'turrethalberstadtcl2_1': 'Halberstadt CL.II',
+    'turrethalberstadtcl2_1_wm_beckap': 'Halberstadt CL.II',
+    'turrethalberstadtcl2_1_wm_beckhe': 'Halberstadt CL.II',
+    'turrethalberstadtcl2_1_wm_beckheap': 'Halberstadt CL.II',
+    'turrethalberstadtcl2_1_wm_twinpar': 'Halberstadt CL.II',
+    'turrethalberstadtcl2_1m': 'Halberstadt CL.II',
+    'turrethalberstadtcl2_1m2': 'Halberstadt CL.II',
+    'turrethalberstadtcl2au_1': 'Halberstadt CL.II 200hp',
+    'turrethalberstadtcl2au_1_wm_beckap': 'Halberstadt CL.II 200hp',
+    'turrethalberstadtcl2au_1_wm_beckhe': 'Halberstadt CL.II 200hp',
+    'turrethalberstadtcl2au_1_wm_beckheap': 'Halberstadt CL.II 200hp',
+    'turrethalberstadtcl2au_1_wm_twinpar': 'Halberstadt CL.II 200hp',
+    'turrethalberstadtcl2au_1m': 'Halberstadt CL.II 200hp',
+    'turrethalberstadtcl2au_1m2': 'Halberstadt CL.II 200hp',
+}
+
+TYPOS = {
+    'Airco DH4': 'Airco D.H.4',
+    'U-2VS': 'U-﻿2',
+}
+
+
+def turret_aircraft_name(turret_name, log_name):
+    """
+    @returns The name of the aircraft the turret belongs to, or None if it is ambiguous and log_name is unknown.
+    """
+    aircraft_name = turret_name[:len(turret_name) - 7]
+    if aircraft_name in TYPOS:
+        aircraft_name = TYPOS[aircraft_name]
+    if aircraft_name in TURRET_AMBIGUITIES:
+        aircraft_name = TURRET_TO_AIRCRAFT.get(log_name)
+    return aircraft_name
+
+
+def turret_aircraft(turret_name, log_name):
+    """
+    @returns The aircraft Object the turret belongs to, or None if the turret is not supported.
+    """
+    aircraft = get_object_catalog().turret_aircraft.get((turret_name, log_name))
+    if aircraft is None:
+        aircraft_name = turret_aircraft_name(turret_name, log_name)
+        if aircraft_name is not None and 'B25' in aircraft_name:
+            # It's an AI flight, which isn't (yet) supported.
+            return None
+        logger.warning("[mod_stats_by_aircraft] Could not find aircraft for turret " + turret_name)
+        return None
+    return aircraft
+
+
+class ObjectCatalog:
+    """
+    In memory copy of the Object table, indexed by id, name and log_name. Also maps each turret to its aircraft.
+
+    The Object table only changes when the game adds new content, so the catalog is loaded once per process.
+    It is reloaded when the row count or the max id of the table changed, which is checked at most every
+    RECHECK_INTERVAL seconds, and whenever an unknown id is looked up.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.checked_at = None
+        # A frozen catalog is never reloaded, e.g. in worker processes which must not query the database.
+        self.frozen = False
+        self.by_id = dict()
+        self.by_name = dict()
+        self.by_log_name = dict()
+        # (turret name, turret log_name) -> aircraft Object. Turrets without a supported aircraft are left out.
+        self.turret_aircraft = dict()
+
+    def refresh_if_stale(self, force=False):
+        if self.frozen:
+            return
+        now = time.monotonic()
+        if not force and self.checked_at is not None and now - self.checked_at < RECHECK_INTERVAL:
+            return
+        self.checked_at = now
+
+        version = Object.objects.aggregate(count=Count('id'), max_id=Max('id'))
+        version = (version['count'], version['max_id'])
+        if version != self.version:
+            self.__load()
+            self.version = version
+
+    def __load(self):
+        by_id = dict()
+        by_name = dict()
+        by_log_name = dict()
+        for db_object in Object.objects.order_by('id'):
+            by_id[db_object.id] = db_object
+            by_name.setdefault(db_object.name, db_object)
+            by_log_name.setdefault(db_object.log_name, db_object)
+
+        turret_aircraft = dict()
+        for db_object in by_id.values():
+            if db_object.cls != 'aircraft_turret':
+                continue
+            aircraft_name = turret_aircraft_name(db_object.name, db_object.log_name)
+            # B25 turrets belong to AI flights, which aren't (yet) supported.
+            if aircraft_name is not None and 'B25' not in aircraft_name and aircraft_name in by_name:
+                turret_aircraft[(db_object.name, db_object.log_name)] = by_name[aircraft_name]
+
+        self.by_id = by_id
+        self.by_name = by_name
+        self.by_log_name = by_log_name
+        self.turret_aircraft = turret_aircraft
+
+    def object(self, object_id):
+        if object_id not in self.by_id:
+            self.refresh_if_stale(force=True)
+        return self.by_id[object_id]
+
+
+CATALOG = ObjectCatalog()
+
+
+def install_object_catalog(catalog):
+    """
+    Replaces the catalog of this process with a frozen copy of catalog.
+    """
+    global CATALOG
+    catalog.frozen = True
+    CATALOG = catalog
+
+
+def get_object_catalog():
+    CATALOG.refresh_if_stale()
+    return CATALOG
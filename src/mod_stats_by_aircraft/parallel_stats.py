@@ -0,0 +1,62 @@
+import multiprocessing
+import pickle
+
+import config
+
+from .aircraft_stats_compute import process_all_aircraft_stats
+from .object_catalog import get_object_catalog
+from .process_workers import init_stats_worker, process_work_unit
+
+AIRCRAFT_STATS_PROCESSES = config.get_conf()['stats'].getint('aircraft_stats_processes')
+if AIRCRAFT_STATS_PROCESSES is None:
+    AIRCRAFT_STATS_PROCESSES = 1
+
+# Missions with fewer sorties are not worth starting worker processes for.
+MIN_SORTIES_PER_PROCESS = 20
+# How many work units each worker process gets on average. More units balance the load better.
+WORK_UNITS_PER_PROCESS = 4
+
+def process_mission_aircraft_stats(sorties, event_index, uow):
+    """
+    Processes the aircraft stats of the new sorties of a mission into uow.
+
+    If configured with aircraft_stats_processes > 1, large missions are split into work units of consecutive sorties,
+    which are processed by a pool of worker processes. The workers record their changes in DeltaUnitOfWorks, which are
+    merged in the order of the sorties. So the result is the same as when processing the sorties one after the other.
+
+    @param sorties The new Sorties of the mission.
+    @param event_index MissionEventIndex of the mission.
+    @param uow StatsUnitOfWork which gets all the changes. It is not flushed.
+    """
+    processes = min(AIRCRAFT_STATS_PROCESSES, len(sorties) // MIN_SORTIES_PER_PROCESS)
+    if processes <= 1:
+        for sortie in sorties:
+            process_all_aircraft_stats(sortie, event_index=event_index, uow=uow)
+        return
+
+    # The workers don't query the database, they get all they need here.
+    for sortie in event_index.sorties.values():
+        # Related objects which were loaded are pickled along with the sortie.
+        for related in ('tour', 'aircraft', 'player'):
+            getattr(sortie, related)
+    for sortie in sorties:
+        ammo_breakdown = sortie.ammo.get('ammo_breakdown', dict())
+        if 'last_turret_account' in ammo_breakdown:
+            uow.turret_player(ammo_breakdown['last_turret_account'], sortie.tour)
+    worker_state = pickle.dumps({
+        'event_index': event_index,
+        'object_catalog': get_object_catalog(),
+        'turret_players': uow.turret_players,
+    })
+
+    sortie_ids = [sortie.id for sortie in sorties]
+    nr_units = processes * WORK_UNITS_PER_PROCESS
+    unit_size = -(-len(sortie_ids) // nr_units)
+    work_units = [sortie_ids[start:start + unit_size] for start in range(0, len(sortie_ids), unit_size)]
+
+    # Spawned like on Windows on every platform, so that the workers behave the same everywhere. See process_workers.
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(processes, initializer=init_stats_worker, initargs=(worker_state,)) as pool:
+        # imap returns the results in the order of work_units, which makes the merge deterministic.
+        for delta in pool.imap(process_work_unit, work_units):
+            uow.merge(delta)
@@ -0,0 +1,60 @@
+"""
+Entry points of the worker processes of the aircraft stats, see parallel_stats.py and retro_work_queue.py.
+
+On Windows the workers are spawned, i.e. they start a fresh interpreter and import this module before anything else.
+Importing models before django.setup() raises AppRegistryNotReady, so this module imports nothing of Django or of the
+rest of this app at module level. Each entry point sets up Django first, and imports the compute code lazily.
+"""
+import pickle
+
+# Set by init_stats_worker in the worker processes.
+WORKER_STATE = dict()
+
+
+def setup_django():
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+def init_stats_worker(worker_state):
+    """
+    Initializer of the worker processes of parallel_stats.process_mission_aircraft_stats.
+
+    @param worker_state Pickled dict with the event index, object catalog and turret players of the mission.
+    """
+    setup_django()
+    from .object_catalog import install_object_catalog
+
+    WORKER_STATE.update(pickle.loads(worker_state))
+    install_object_catalog(WORKER_STATE['object_catalog'])
+
+
+def process_work_unit(sortie_ids):
+    """
+    @returns DeltaUnitOfWork with the changes of the sorties, which the parent merges.
+    """
+    from .aircraft_stats_compute import process_all_aircraft_stats
+    from .unit_of_work import DeltaUnitOfWork
+
+    event_index = WORKER_STATE['event_index']
+    uow = DeltaUnitOfWork(WORKER_STATE['turret_players'])
+    for sortie_id in sortie_ids:
+        process_all_aircraft_stats(event_index.sorties[sortie_id], event_index=event_index, uow=uow)
+    return uow
+
+
+def init_retro_worker():
+    """
+    Initializer of the worker processes of retro_work_queue.run_retro_workers.
+    """
+    setup_django()
+
+
+def drain_retro_queue(worker):
+    """
+    @returns Number of chunks the worker processed, see retro_work_queue.drain_queue.
+    """
+    from .background_jobs.retro_work_queue import drain_queue
+    return drain_queue()
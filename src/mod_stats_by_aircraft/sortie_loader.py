@@ -0,0 +1,36 @@
+from stats.models import Sortie
+from .variant_utils import FILTER_TYPE_ANNOTATION
+
+# Related objects which the aircraft stats read from every sortie.
+SORTIE_RELATED = ['tour', 'aircraft', 'player', 'SortieAugmentation_MOD_STATS_BY_AIRCRAFT']
+# Columns of Sortie which can be large, but are never read by the aircraft stats.
+UNUSED_SORTIE_COLUMNS = ['debug', 'score_dict']
+
+
+def unused_sortie_columns(prefix=''):
+    """
+    @param prefix Lookup of the sortie, e.g. 'act_sortie__', if the sorties are joined into another model.
+    @returns The UNUSED_SORTIE_COLUMNS which the installed version of IL2 stats has, for QuerySet.defer.
+    """
+    existing = {field.name for field in Sortie._meta.concrete_fields}
+    return [prefix + name for name in UNUSED_SORTIE_COLUMNS if name in existing]
+
+
+def lean_sorties(queryset):
+    """
+    Makes a Sortie QuerySet load the sorties the way the aircraft stats use them: tour, aircraft, player and
+    SortieAugmentation are joined in, the stored filter type is annotated, and large unused columns are left out.
+
+    Otherwise every sortie queries its tour, aircraft, player and SortieAugmentation on its own.
+    """
+    return (queryset
+            .select_related(*SORTIE_RELATED)
+            .defer(*unused_sortie_columns())
+            .annotate(**FILTER_TYPE_ANNOTATION))
+
+
+def iterate_sorties(queryset):
+    """
+    Iterates over the sorties of queryset with a server side cursor, instead of loading all of them at once.
+    """
+    return queryset.iterator()
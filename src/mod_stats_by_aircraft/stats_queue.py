@@ -0,0 +1,57 @@
+from django.db import transaction
+
+from stats.logger import logger
+from stats.models import Sortie
+from .aircraft_mod_models import AircraftStatsQueue
+from .bucket_delta_log import bucket_delta_log
+from .contributions import ContributionRecorder
+from .db_utils import lock_aircraft_stats
+from .event_index import MissionEventIndex
+from .parallel_stats import process_mission_aircraft_stats
+from .sortie_loader import lean_sorties
+from .unit_of_work import StatsUnitOfWork
+
+
+def enqueue_mission(mission):
+    """
+    Queues the aircraft stats of a mission. Called inside the transaction of stats_whore, so the mission is queued
+    if and only if its core stats are committed.
+    """
+    AircraftStatsQueue.objects.create(mission=mission)
+
+
+def process_aircraft_stats_queue():
+    """
+    Computes the aircraft stats of the oldest queued mission, then removes it from the queue. Both happen in one
+    transaction, so a mission stays queued until its aircraft stats are committed.
+
+    A mission may still be processed twice, e.g. if the queue entry was restored from a backup. Sorties which already
+    have their aircraft stats, according to their SortieAugmentation, are skipped then.
+
+    @returns True if a mission was processed, False if the queue is empty.
+    """
+    with transaction.atomic():
+        # Skip locked entries, so that several consumers never process the same mission.
+        entry = AircraftStatsQueue.objects.select_for_update(skip_locked=True).order_by('id').first()
+        if entry is None:
+            return False
+        # Waits for a retro compute worker, if it writes the same tour.
+        lock_aircraft_stats(tour_ids=[entry.mission.tour_id])
+
+        sorties = list(lean_sorties(Sortie.objects
+                                    .filter(mission_id=entry.mission_id, aircraft__cls_base='aircraft')
+                                    .exclude(SortieAugmentation_MOD_STATS_BY_AIRCRAFT__sortie_stats_processed=True)
+                                    .order_by('id')))
+        if sorties:
+            event_index = MissionEventIndex.for_mission(entry.mission_id, sorties)
+            # Records what the mission adds, so that it can be undone with retract_mission.
+            uow = StatsUnitOfWork(ContributionRecorder(entry.mission_id), bucket_delta_log())
+            uow.prefetch_buckets(sorties)
+            process_mission_aircraft_stats(sorties, event_index, uow)
+            uow.flush()
+
+        entry.delete()
+
+    logger.info('[mod_stats_by_aircraft]: Computed aircraft stats of mission {}, {} sorties.'
+                .format(entry.mission_id, len(sorties)))
+    return True
@@ -7,7 +7,8 @@ from stats.logger import logger
 from stats.online import update_online
 from stats.models import LogEntry, Mission, PlayerMission, VLife, PlayerAircraft, Object, Score, Sortie, Tour, Player
 from .background_jobs.run_background_jobs import run_background_jobs, reset_corrupted_data
-from .aircraft_stats_compute import process_aircraft_stats
+from .stats_queue import enqueue_mission, process_aircraft_stats_queue
+from .bucket_delta_log import compact_bucket_deltas_if_due
 from users.utils import cleanup_registration
 from django.conf import settings
 from django.db.models import Q, F, Max, Count
@@ -83,6 +84,10 @@ def main():
                 processed_reports.append(m_report_file.name)
                 continue
         # ======================== MODDED PART BEGIN
+        # Only once all reports are in, so that their core stats show up as soon as possible.
+        compact_bucket_deltas_if_due()
+        if process_aircraft_stats_queue():
+            continue
         background_work_done = run_background_jobs()
         if background_work_done:
             continue
@@ -343,8 +348,7 @@ def stats_whore(m_report_file):
         p.save()
 
     # ======================== MODDED PART BEGIN
-    for sortie in new_sorties:
-        process_aircraft_stats(sortie)
-        process_aircraft_stats(sortie, player=sortie.player)
+    # The aircraft stats are computed after this transaction commits, see process_aircraft_stats_queue.
+    enqueue_mission(mission)
     # ======================== MODDED PART END
     logger.info('{mission} - processing finished'.format(mission=m_report_file.stem))
@@ -0,0 +1,139 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Q
+
+from stats.logger import logger
+from stats.models import Sortie
+from .aircraft_mod_models import AircraftBucket, AircraftKillboard, AircraftBucketMembership, SortieAugmentation
+from .aircraft_stats_compute import process_all_aircraft_stats
+from .ammo_file_manager import write_breakdown_line
+from .bucket_delta_log import compact_all_bucket_deltas
+from .contributions import forget_buckets
+from .db_utils import lock_aircraft_stats
+from .event_index import MissionEventIndex
+from .sortie_loader import lean_sorties, iterate_sorties
+from .unit_of_work import StatsUnitOfWork, BUCKET_UPDATE_FIELDS
+from .variant_utils import classify_sortie
+
+# The fields which are set back to their defaults before the buckets are recomputed. The reset flags are kept, since
+# they mark fixes which the recompute doesn't need.
+RESET_FIELDS = [field for field in BUCKET_UPDATE_FIELDS
+                if AircraftBucket._meta.get_field(field).get_internal_type() != 'BooleanField']
+
+
+def recompute_aircraft(aircraft_id, tour_cutoff):
+    """
+    Recomputes the buckets of one aircraft, e.g. after the variant rules in variant_utils changed for it.
+
+    1. The sorties of the aircraft are classified again.
+    2. The buckets of the aircraft are reset, and their killboards are deleted.
+    3. The sorties which touched those buckets are found with AircraftBucketMembership, and processed again. Only the
+       changes to the buckets of the aircraft and their killboards are written back, see TargetedUnitOfWork.
+
+    Sorties which were processed before AircraftBucketMembership existed are not indexed. If the aircraft has such
+    sorties, only its own sorties are found, and the killboards against it lose what its enemies added. A full retro
+    compute is needed then.
+
+    Elo is recomputed from the default, against the current Elo of the enemies, so it differs from a full recompute.
+    The ammo breakdown csv files are not rewritten. Missions which are retracted afterwards keep what they added to the
+    buckets of the aircraft, see contributions.forget_buckets.
+
+    @param aircraft_id Object id of the aircraft.
+    @param tour_cutoff The first tour which is recomputed.
+    """
+    with transaction.atomic():
+        # Waits for the stats loop and the retro compute workers to finish their current work, and pauses them until
+        # the commit.
+        lock_aircraft_stats(exclusive=True)
+        # Otherwise the pending deltas would be folded into the buckets after they were recomputed.
+        compact_all_bucket_deltas()
+        own_sorties = (Sortie.objects.filter(aircraft_id=aircraft_id, tour__id__gte=tour_cutoff,
+                                             SortieAugmentation_MOD_STATS_BY_AIRCRAFT__sortie_stats_processed=True)
+                       .order_by('id'))
+        __reclassify(own_sorties)
+
+        # Locked until the commit, so that the stats of new missions are not lost in between.
+        bucket_ids = list(AircraftBucket.objects.select_for_update()
+                          .filter(aircraft_id=aircraft_id, tour__id__gte=tour_cutoff)
+                          .values_list('id', flat=True))
+        sortie_ids = set(AircraftBucketMembership.objects.filter(bucket_id__in=bucket_ids)
+                         .values_list('sortie_id', flat=True))
+        sortie_ids.update(own_sorties.values_list('id', flat=True))
+        unindexed = (own_sorties.exclude(id__in=AircraftBucketMembership.objects.filter(bucket_id__in=bucket_ids)
+                                         .values('sortie_id'))
+                     .count())
+        if unindexed:
+            logger.warning('[mod_stats_by_aircraft]: {} sorties of aircraft {} have no bucket memberships, the '
+                           'killboards against it may be incomplete.'.format(unindexed, aircraft_id))
+
+        AircraftBucket.objects.filter(id__in=bucket_ids).update(
+            **{field: AircraftBucket._meta.get_field(field).get_default() for field in RESET_FIELDS})
+        AircraftKillboard.objects.filter(Q(aircraft_1_id__in=bucket_ids) | Q(aircraft_2_id__in=bucket_ids)).delete()
+        # The sorties may now belong to other buckets of the aircraft, the memberships are recorded again.
+        AircraftBucketMembership.objects.filter(bucket_id__in=bucket_ids).delete()
+        # What the missions contributed to the buckets is computed anew, so retract_mission must not subtract it.
+        forget_buckets(bucket_ids, tour_cutoff)
+
+        sorties_by_mission = defaultdict(list)
+        for sortie in lean_sorties(Sortie.objects.filter(id__in=sortie_ids).order_by('id')):
+            sorties_by_mission[sortie.mission_id].append(sortie)
+
+        uow = TargetedUnitOfWork(aircraft_id, tour_cutoff)
+        for mission_id in sorted(sorties_by_mission):
+            sorties = sorties_by_mission[mission_id]
+            event_index = MissionEventIndex.for_mission(mission_id, sorties)
+            for sortie in sorties:
+                process_all_aircraft_stats(sortie, is_retro_compute=True, event_index=event_index, uow=uow)
+            # The tiks of the Elo encounters are only comparable within a mission.
+            uow.elo_batch.apply()
+        uow.flush()
+
+    logger.info('[mod_stats_by_aircraft]: Recomputed {} buckets of aircraft {} from {} sorties.'
+                .format(len(bucket_ids), aircraft_id, len(sortie_ids)))
+
+
+def __reclassify(sorties):
+    sortie_ids_by_type = defaultdict(list)
+    for sortie in iterate_sorties(lean_sorties(sorties)):
+        sortie_ids_by_type[classify_sortie(sortie)].append(sortie.id)
+
+    for filter_type, sortie_ids in sortie_ids_by_type.items():
+        SortieAugmentation.objects.filter(sortie_id__in=sortie_ids).update(filter_type=filter_type)
+
+
+class TargetedUnitOfWork(StatsUnitOfWork):
+    """
+    Unit of work which only writes back the changes to the buckets of one aircraft, and to their killboards.
+
+    The other buckets are still loaded and changed in memory, since the stats code needs them, e.g. for Elo. Their
+    changes are dropped on flush, as are the SortieAugmentation flags.
+    """
+
+    def __init__(self, aircraft_id, tour_cutoff):
+        super().__init__()
+        self.aircraft_id = aircraft_id
+        self.tour_cutoff = tour_cutoff
+
+    def ordered(self, function, *args):
+        # The csv lines of the sorties are already in the ammo breakdown files.
+        if function is write_breakdown_line:
+            return None
+        return function(*args)
+
+    def flush(self):
+        self.sortie_counters.apply()
+        self.elo_batch.apply()
+
+        self.buckets = {key: bucket for key, bucket in self.buckets.items() if self.__is_target(bucket)}
+        self.memberships = {(sortie_id, key) for sortie_id, key in self.memberships if key in self.buckets}
+        self.killboards = {key: delta for key, delta in self.killboards.items()
+                           if self.__is_target(delta.aircraft_1) or self.__is_target(delta.aircraft_2)}
+        # The streaks of the other buckets were continued from their final values, they are not candidates.
+        self.leaderboard.candidates = {key: candidate for key, candidate in self.leaderboard.candidates.items()
+                                       if key[2] == self.aircraft_id}
+        self.sortie_flags.clear()
+        super().flush()
+
+    def __is_target(self, bucket):
+        return bucket.aircraft_id == self.aircraft_id and bucket.tour_id >= self.tour_cutoff
@@ -0,0 +1,421 @@
+from contextlib import contextmanager
+
+from stats.models import Player
+from .aircraft_mod_models import (AircraftBucket, AircraftKillboard, AircraftBucketMembership, SortieAugmentation,
+                                  RECEIVED)
+from .db_utils import bulk_update, copy_update, upsert_increment, upsert_flags, insert_ignore, fetch_or_create
+from .counter_matrix import SortieCounters
+from .elo import EloBatch
+from .leaderboard import StreakLeaderboard, LEADERBOARD_RECORD_FIELDS
+from .variant_utils import get_sortie_type, has_juiced_variant, has_bomb_variant
+
+BUCKET_NATURAL_KEY = ('tour', 'aircraft', 'filter_type', 'player')
+BUCKET_UPDATE_FIELDS = [field.name for field in AircraftBucket._meta.concrete_fields
+                        if not field.primary_key and field.name not in BUCKET_NATURAL_KEY]
+# The records of the buckets without player are only ever raised by the StreakLeaderboard.
+GLOBAL_BUCKET_UPDATE_FIELDS = [field for field in BUCKET_UPDATE_FIELDS if field not in LEADERBOARD_RECORD_FIELDS]
+
+KILLBOARD_NATURAL_KEY = ('aircraft_1', 'aircraft_2', 'tour')
+KILLBOARD_COUNTER_FIELDS = [
+    'aircraft_1_kills', 'aircraft_1_shotdown', 'aircraft_1_assists', 'aircraft_1_pk_assists',
+    'aircraft_2_kills', 'aircraft_2_shotdown', 'aircraft_2_assists', 'aircraft_2_pk_assists',
+    'aircraft_1_distinct_hits', 'aircraft_2_distinct_hits',
+]
+# Every killboard written by the current code is free of the old corrupted data.
+KILLBOARD_FLAG_FIELDS = ['reset_kills_turret_bug', 'reset_player_loses', 'reset_lethality']
+
+# Bucket fields which only ever get added onto. Changes to these from several sorties can be summed up in any order.
+BUCKET_COUNTER_FIELDS = [
+    'total_sorties', 'total_flight_time', 'kills', 'ground_kills', 'assists', 'score', 'aircraft_lost', 'deaths',
+    'captures', 'bailouts', 'ditches', 'landings', 'in_flight', 'crashes', 'shotdown',
+    'deaths_to_accident', 'deaths_to_aa', 'aircraft_lost_to_accident', 'aircraft_lost_to_aa',
+    'ammo_shot', 'ammo_hit', 'bomb_rocket_shot', 'bomb_rocket_hit',
+    'sorties_plane_was_hit', 'plane_survivability_counter', 'pilot_survivability_counter',
+    'plane_lethality_counter', 'pilot_lethality_counter', 'distinct_enemies_hit', 'pilot_kills',
+]
+# Dito for JSON fields of the form {key: count}.
+BUCKET_COUNTER_DICT_FIELDS = ['killboard_planes', 'killboard_ground']
+
+SORTIE_AUGMENTATION_FLAG_FIELDS = [field.name for field in SortieAugmentation._meta.concrete_fields
+                                   if field.get_internal_type() == 'BooleanField']
+
+
+def bucket_key(tour, aircraft, filter_type, player):
+    return tour.id, aircraft.id, filter_type, player.id if player is not None else None
+
+
+class KillboardDelta:
+    """
+    Increments to the counters of the AircraftKillboard between two buckets.
+
+    Has the same natural key and counter fields as AircraftKillboard, so the stats code updates it the same way it
+    would update a killboard.
+    """
+
+    def __init__(self, aircraft_1, aircraft_2, tour):
+        self.aircraft_1 = aircraft_1
+        self.aircraft_2 = aircraft_2
+        self.tour = tour
+        for field in KILLBOARD_COUNTER_FIELDS:
+            setattr(self, field, 0)
+
+    def as_row(self):
+        return ((self.aircraft_1.id, self.aircraft_2.id, self.tour.id)
+                + tuple(getattr(self, field) for field in KILLBOARD_COUNTER_FIELDS)
+                + (True,) * len(KILLBOARD_FLAG_FIELDS))
+
+
+class StatsUnitOfWork:
+    """
+    Identity map of AircraftBuckets, keyed by (tour, aircraft, filter_type, player).
+
+    Every AircraftBucket needed while processing a mission is loaded once and handed out as a single in memory
+    instance. The buckets are written back in bulk by flush, after their derived fields were updated once.
+
+    Previously, popular buckets were loaded and saved dozens of times per mission, and two copies of the same bucket
+    could overwrite each other's changes.
+
+    Killboard changes are collected as KillboardDeltas, merged per killboard, and added onto the AircraftKillboards
+    with a single upsert by flush. The same goes for the SortieAugmentation flags of the processed sorties.
+
+    Elo encounters are collected in an EloBatch, which flush applies in the order of the shotdowns. Likewise the
+    counters of the sorties are summed up per bucket by flush, see SortieCounters. The records of the buckets without
+    player are raised by a StreakLeaderboard.
+
+    The buckets handed out while processing a sortie are recorded as its AircraftBucketMembership, see processing.
+
+    If a ContributionRecorder is passed in, flush also stores what was added onto the buckets and killboards, so that
+    it can be retracted later. See contributions.py. If a BucketDeltaLog is passed in, the changes to the buckets
+    without player are appended to it, instead of written into the buckets. See bucket_delta_log.py.
+
+    With bulk_load, flush streams the rows into staging tables with COPY, and merges each table with one statement.
+    That pays off for batches of thousands of sorties, e.g. in the full retro compute.
+    """
+
+    def __init__(self, contribution=None, delta_log=None, bulk_load=False):
+        self.contribution = contribution
+        self.delta_log = delta_log
+        self.bulk_load = bulk_load
+        self.buckets = dict()
+        self.killboards = dict()
+        self.sortie_flags = dict()
+        self.turret_players = dict()
+        self.elo_batch = EloBatch()
+        self.sortie_counters = SortieCounters()
+        self.leaderboard = StreakLeaderboard()
+        # Pairs of sortie id and bucket key, see processing.
+        self.memberships = set()
+        self.current_sortie_id = None
+
+    def bucket(self, tour, aircraft, filter_type='NO_FILTER', player=None):
+        """
+        Finds or creates the bucket. Every bucket handed out is considered dirty, and is written back by flush.
+        """
+        key = bucket_key(tour, aircraft, filter_type, player)
+        if key not in self.buckets:
+            self.__load_buckets([(tour, aircraft, filter_type, player)])
+        if self.current_sortie_id is not None:
+            self.memberships.add((self.current_sortie_id, key))
+        return self.buckets[key]
+
+    def prefetch_buckets(self, sorties):
+        """
+        Fetches or creates the buckets of the sorties with a single statement, before the sorties are processed.
+        """
+        natural_keys = dict()
+        for sortie in sorties:
+            filter_types = ['NO_FILTER']
+            if has_juiced_variant(sortie.aircraft) or has_bomb_variant(sortie.aircraft):
+                filter_types.append(get_sortie_type(sortie))
+            for player in (None, sortie.player):
+                for filter_type in filter_types:
+                    key = bucket_key(sortie.tour, sortie.aircraft, filter_type, player)
+                    if key not in self.buckets:
+                        natural_keys[key] = (sortie.tour, sortie.aircraft, filter_type, player)
+        self.__load_buckets(list(natural_keys.values()))
+
+    def __load_buckets(self, natural_keys):
+        """
+        @param natural_keys Tuples of (tour, aircraft, filter_type, player) of buckets which weren't handed out yet.
+        """
+        buckets = fetch_or_create(AircraftBucket, BUCKET_NATURAL_KEY, [
+            AircraftBucket(tour=tour, aircraft=aircraft, filter_type=filter_type, player=player)
+            for tour, aircraft, filter_type, player in natural_keys])
+        for tour, aircraft, filter_type, player in natural_keys:
+            key = bucket_key(tour, aircraft, filter_type, player)
+            bucket = buckets[key]
+            # Reuse the instances we have, otherwise update_derived_fields would query each of them again.
+            bucket.tour = tour
+            bucket.aircraft = aircraft
+            bucket.player = player
+            self.buckets[key] = bucket
+            if self.contribution is not None:
+                self.contribution.snapshot(bucket)
+            if self.delta_log is not None and player is None:
+                self.delta_log.snapshot(bucket)
+
+    @contextmanager
+    def processing(self, sortie):
+        """
+        Every bucket handed out inside the with block is recorded as touched by the sortie.
+        """
+        self.current_sortie_id = sortie.id
+        try:
+            yield
+        finally:
+            self.current_sortie_id = None
+
+    def killboard(self, bucket, enemy_bucket):
+        """
+        @returns The KillboardDelta between the two buckets. The bucket with the lower id is aircraft_1.
+        """
+        if bucket.id < enemy_bucket.id:
+            aircraft_1, aircraft_2 = bucket, enemy_bucket
+        else:
+            aircraft_1, aircraft_2 = enemy_bucket, bucket
+
+        key = (aircraft_1.id, aircraft_2.id)
+        if key not in self.killboards:
+            self.killboards[key] = KillboardDelta(aircraft_1, aircraft_2, bucket.tour)
+        return self.killboards[key]
+
+    def turret_player(self, account, tour):
+        """
+        @returns The pilot Player of the tour with the given profile uuid, or None if there is none.
+        """
+        key = (account, tour.id)
+        if key not in self.turret_players:
+            try:
+                self.turret_players[key] = Player.objects.filter(profile__uuid=account, tour=tour, type='pilot').get()
+            except Player.DoesNotExist:
+                self.turret_players[key] = None
+        return self.turret_players[key]
+
+    def count_sortie(self, bucket, sortie, takeoff_count):
+        """
+        Adds the counters of the sortie (sorties, kills, deaths, ammo, ...) onto bucket, at the latest on flush.
+
+        @param takeoff_count How many times the sortie took off, see MissionEventIndex.takeoff_count.
+        """
+        self.sortie_counters.add(bucket, sortie, takeoff_count)
+
+    def elo(self, tik, relation, winner, loser, loser_main=None):
+        """
+        Records an Elo encounter between buckets handed out by this unit of work. See elo.update_elo.
+        """
+        self.elo_batch.add(tik, relation, winner, loser, loser_main)
+
+    def ordered(self, function, *args):
+        """
+        Calls function(*args). Used for the changes whose result depends on the order in which sorties are processed,
+        e.g. streaks and ammo breakdown samples. See DeltaUnitOfWork.
+        """
+        return function(*args)
+
+    def merge(self, delta):
+        """
+        Applies the changes recorded by a DeltaUnitOfWork onto the buckets of this unit of work, as if the sorties of
+        delta had been processed with this unit of work.
+        """
+        delta.sortie_counters.apply()
+        for key, delta_bucket in delta.buckets.items():
+            bucket = self.bucket(delta_bucket.tour, delta_bucket.aircraft, delta_bucket.filter_type,
+                                 delta_bucket.player)
+            for field in BUCKET_COUNTER_FIELDS:
+                setattr(bucket, field, getattr(bucket, field) + getattr(delta_bucket, field))
+            for field in BUCKET_COUNTER_DICT_FIELDS:
+                counts = getattr(bucket, field)
+                for count_key, value in getattr(delta_bucket, field).items():
+                    counts[count_key] = counts.get(count_key, 0) + value
+            if delta_bucket.coalition is not None:
+                bucket.coalition = delta_bucket.coalition
+
+        for (key_1, key_2), delta_kb in delta.killboards.items():
+            bucket_1 = self.buckets[key_1]
+            bucket_2 = self.buckets[key_2]
+            kb = self.killboard(bucket_1, bucket_2)
+            # The stats code picks the side of a killboard by comparing aircraft. If both sides have the same aircraft,
+            # everything was counted on the aircraft_1 side, no matter which bucket that is.
+            same_side = kb.aircraft_1 is bucket_1 or bucket_1.aircraft_id == bucket_2.aircraft_id
+            for field in KILLBOARD_COUNTER_FIELDS:
+                target_field = field if same_side else swap_killboard_side(field)
+                setattr(kb, target_field, getattr(kb, target_field) + getattr(delta_kb, field))
+
+        self.memberships.update(delta.memberships)
+        for sortie_id, (filter_type, flags) in delta.sortie_flags.items():
+            if sortie_id not in self.sortie_flags:
+                self.sortie_flags[sortie_id] = (filter_type, set())
+            self.sortie_flags[sortie_id][1].update(flags)
+
+        for encounter in delta.elo_batch.encounters:
+            self.elo(encounter.tik, encounter.relation, self.buckets[encounter.winner.mod_bucket_key],
+                     self.buckets[encounter.loser.mod_bucket_key],
+                     self.buckets[encounter.loser_main.mod_bucket_key] if encounter.loser_main is not None else None)
+
+        for function, args in delta.ordered_changes:
+            self.ordered(function, *[self.__resolve(arg) for arg in args])
+
+    def __resolve(self, arg):
+        if isinstance(arg, BucketRef):
+            return self.buckets[arg.key]
+        if isinstance(arg, UnitOfWorkRef):
+            return self
+        return arg
+
+    def mark_sortie(self, sortie, *flags):
+        """
+        Sets the given SortieAugmentation flags of the sortie to True on flush, and stores its filter type.
+        The SortieAugmentation is created if it does not exist yet.
+        """
+        if sortie.id not in self.sortie_flags:
+            self.sortie_flags[sortie.id] = (get_sortie_type(sortie), set())
+        self.sortie_flags[sortie.id][1].update(flags)
+
+    def flush(self):
+        """
+        Adds up the sortie counters, applies the Elo encounters, updates the derived fields of all buckets handed out,
+        and writes them back into the database, along with their memberships and the contribution if there is one.
+        Then raises the records of the leaderboard, adds the collected killboard deltas onto the AircraftKillboards,
+        and sets the SortieAugmentation flags.
+        """
+        self.sortie_counters.apply()
+        self.elo_batch.apply()
+        if self.contribution is not None:
+            self.contribution.save(self.buckets.values(), self.killboards.values())
+        global_buckets = [bucket for bucket in self.buckets.values() if bucket.player_id is None]
+        player_buckets = [bucket for bucket in self.buckets.values() if bucket.player_id is not None]
+        if self.delta_log is not None:
+            self.delta_log.append(global_buckets)
+            global_buckets = []
+        for bucket in global_buckets + player_buckets:
+            bucket.update_derived_fields()
+        update = copy_update if self.bulk_load else bulk_update
+        update(AircraftBucket, global_buckets, GLOBAL_BUCKET_UPDATE_FIELDS)
+        update(AircraftBucket, player_buckets, BUCKET_UPDATE_FIELDS)
+        insert_ignore(AircraftBucketMembership, ['sortie', 'bucket'],
+                      [(sortie_id, self.buckets[key].id) for sortie_id, key in self.memberships], self.bulk_load)
+        self.memberships.clear()
+        self.buckets.clear()
+        self.leaderboard.flush()
+
+        upsert_increment(AircraftKillboard, KILLBOARD_NATURAL_KEY, KILLBOARD_COUNTER_FIELDS,
+                         [delta.as_row() for delta in self.killboards.values()], KILLBOARD_FLAG_FIELDS,
+                         self.bulk_load)
+        self.killboards.clear()
+
+        upsert_flags(SortieAugmentation, ['sortie'], SORTIE_AUGMENTATION_FLAG_FIELDS,
+                     [(sortie_id,) + tuple(field in flags for field in SORTIE_AUGMENTATION_FLAG_FIELDS) + (filter_type,)
+                      for sortie_id, (filter_type, flags) in self.sortie_flags.items()],
+                     ['filter_type'], self.bulk_load)
+        self.sortie_flags.clear()
+
+
+class BucketRef:
+    def __init__(self, key):
+        self.key = key
+
+
+class UnitOfWorkRef:
+    pass
+
+
+class DeltaUnitOfWork(StatsUnitOfWork):
+    """
+    Records the changes of processing sorties without touching the database, so that sorties can be processed in
+    worker processes. The parent process applies the recorded changes with StatsUnitOfWork.merge.
+
+    Buckets handed out start at zero, so that afterwards they hold the increments of their counter fields.
+    Calls to ordered are recorded, and replayed by merge on the real buckets in the same order.
+    """
+
+    def __init__(self, turret_players):
+        """
+        @param turret_players turret_players of a StatsUnitOfWork, which already looked up every Player needed.
+        """
+        super().__init__()
+        self.turret_players = turret_players
+        self.ordered_changes = []
+
+    def bucket(self, tour, aircraft, filter_type='NO_FILTER', player=None):
+        key = bucket_key(tour, aircraft, filter_type, player)
+        if key not in self.buckets:
+            bucket = AircraftBucket(tour=tour, aircraft=aircraft, filter_type=filter_type, player=player)
+            # None marks that no sortie of this delta set the coalition.
+            bucket.coalition = None
+            bucket.mod_bucket_key = key
+            self.buckets[key] = bucket
+        if self.current_sortie_id is not None:
+            self.memberships.add((self.current_sortie_id, key))
+        return self.buckets[key]
+
+    def killboard(self, bucket, enemy_bucket):
+        """
+        The buckets have no ids yet, so the sides are picked by the natural keys. merge swaps them if needed.
+        """
+        if sortable_bucket_key(bucket.mod_bucket_key) < sortable_bucket_key(enemy_bucket.mod_bucket_key):
+            aircraft_1, aircraft_2 = bucket, enemy_bucket
+        else:
+            aircraft_1, aircraft_2 = enemy_bucket, bucket
+
+        key = (aircraft_1.mod_bucket_key, aircraft_2.mod_bucket_key)
+        if key not in self.killboards:
+            self.killboards[key] = KillboardDelta(aircraft_1, aircraft_2, bucket.tour)
+        return self.killboards[key]
+
+    def turret_player(self, account, tour):
+        return self.turret_players.get((account, tour.id))
+
+    def ordered(self, function, *args):
+        self.ordered_changes.append((function, tuple(self.__reference(arg) for arg in args)))
+
+    def __reference(self, arg):
+        if arg is self:
+            return UnitOfWorkRef()
+        if isinstance(arg, AircraftBucket):
+            return BucketRef(arg.mod_bucket_key)
+        return arg
+
+    def flush(self):
+        raise NotImplementedError('A DeltaUnitOfWork is applied with StatsUnitOfWork.merge.')
+
+
+def increment_ammo(uow, bucket, side, ammo_dict, pilot_snipe):
+    """
+    Adds an ammo breakdown sample onto bucket, and records it in the contribution and delta log of uow.
+    Called through uow.ordered.
+
+    @param side RECEIVED or GIVEN.
+    """
+    if side == RECEIVED:
+        bucket.increment_ammo_received(ammo_dict, pilot_snipe)
+    else:
+        bucket.increment_ammo_given(ammo_dict, pilot_snipe)
+    if uow.contribution is not None:
+        uow.contribution.add_ammo(bucket, side, ammo_dict, pilot_snipe)
+    if uow.delta_log is not None and bucket.player_id is None:
+        uow.delta_log.add_ammo(bucket, side, ammo_dict, pilot_snipe)
+
+
+def sortable_bucket_key(key):
+    tour_id, aircraft_id, filter_type, player_id = key
+    return tour_id, aircraft_id, filter_type, player_id if player_id is not None else 0
+
+
+def swap_killboard_side(field):
+    if field.startswith('aircraft_1_'):
+        return field.replace('aircraft_1_', 'aircraft_2_', 1)
+    return field.replace('aircraft_2_', 'aircraft_1_', 1)
+
+
+@contextmanager
+def unit_of_work(uow=None):
+    """
+    Yields uow if one was passed in. Otherwise yields a new StatsUnitOfWork, which is flushed on exit.
+    """
+    if uow is not None:
+        yield uow
+        return
+
+    uow = StatsUnitOfWork()
+    yield uow
+    uow.flush()
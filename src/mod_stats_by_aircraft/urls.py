@@ -58,6 +58,7 @@ urlpatterns = [
 
     url(r'^download_ammo_breakdown_csv/(?P<ammo_key>\S+)/(?P<breakdown_type>\S+)/(?P<bucket_id>\d+)/$',
         views.download_ammo_breakdown_csv, name='download_ammo_breakdown_csv'),
+    url(r'^background_jobs_status/$', views.background_jobs_status, name='background_jobs_status'),
 
     url(r'^online/$', views.online, name='online'),
     url(r'^$', views.main, name='main'),
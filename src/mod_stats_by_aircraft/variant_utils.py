@@ -1,3 +1,7 @@
+import re
+
+from django.db.models import F
+
 BOMB_VARIANT_WHITE_LIST = {'P-38J-25', 'Me 262 A', 'Bristol F2B (F.II)', 'Bristol F2B (F.III)', 'Halberstadt CL.II',
                            'Halberstadt CL.II 200hp', 'Mosquito F.B. Mk.VI ser.2'}
 BOMB_VARIANT_BLACK_LIST = {'Spitfire Mk.VB', 'Yak-9 series 1', 'Yak-9T series 1', 'Albatros D.Va',
@@ -13,10 +17,30 @@ JABO_MODS = {'Ground attack modification', 'U17 strike modification'}
 BOMBS_ROCKETS = ['FAB-100M', 'FAB-250tsk', 'GP ', 'MC ', 'SC ', 'SD ', '21cm WGr.42', 'lb Cooper', 'H.E.R.L.',
                  'Pz.Bl. 1', 'R-Sprgr. M8', 'P.u.W', 'ROS-82', 'RBS-82', 'ROFS-132', '50-T', '100-T', 'M64', 'M65',
                  'M8', 'FAB-250sv', 'FAB-500M', 'RP-3']
+BOMBS_ROCKETS_REGEX = re.compile('|'.join(re.escape(bomb_rocket) for bomb_rocket in BOMBS_ROCKETS))
+
+# Attribute of a Sortie which holds its filter type, see get_sortie_type.
+FILTER_TYPE_ATTRIBUTE = 'mod_filter_type'
+# Sortie.objects.annotate(**FILTER_TYPE_ANNOTATION) loads the stored filter types for get_sortie_type.
+FILTER_TYPE_ANNOTATION = {FILTER_TYPE_ATTRIBUTE: F('SortieAugmentation_MOD_STATS_BY_AIRCRAFT__filter_type')}
 
 
-# Whether the aircraft has an upgraded engine or better fuel
 def get_sortie_type(sortie):
+    """
+    Filter type of the sortie, i.e. the AircraftBucket.filter_type of its filtered buckets.
+
+    The sortie is classified at most once. The result is kept on the sortie, and stored in SortieAugmentation.filter_type
+    when the sortie is processed. Querysets annotated with FILTER_TYPE_ANNOTATION load the stored value.
+    """
+    filter_type = getattr(sortie, FILTER_TYPE_ATTRIBUTE, None)
+    if filter_type is None:
+        filter_type = classify_sortie(sortie)
+        setattr(sortie, FILTER_TYPE_ATTRIBUTE, filter_type)
+    return filter_type
+
+
+# Whether the aircraft has an upgraded engine or better fuel
+def classify_sortie(sortie):
     aircraft = sortie.aircraft
     if not has_juiced_variant(aircraft) and not has_bomb_variant(aircraft):
         return "NO_FILTER"
@@ -49,10 +73,7 @@ def is_jabo(sortie):
 
 
 def __payload_has_bomb(payload):
-    for bomb_rocket in BOMBS_ROCKETS:
-        if bomb_rocket in str(payload):
-            return True
-    return False
+    return BOMBS_ROCKETS_REGEX.search(str(payload)) is not None
 
 
 def is_juiced(sortie):
@@ -3,7 +3,7 @@ from datetime import timedelta
 from django.conf import settings
 from django.core.exceptions import PermissionDenied
 from django.db.models import Q, Sum
-from django.http import Http404, HttpResponse
+from django.http import Http404, HttpResponse, JsonResponse
 from django.shortcuts import render, get_object_or_404, redirect
 from django.utils import timezone
 from django.urls import reverse
@@ -18,7 +18,8 @@ from stats import sortie_log
 from stats.views import *
 
 from .variant_utils import has_juiced_variant, has_bomb_variant
-from .aircraft_mod_models import AircraftBucket, AircraftKillboard, compute_float, get_aircraft_pilot_rankings_url
+from .aircraft_mod_models import (AircraftBucket, AircraftKillboard, AircraftBackgroundJobState, compute_float,
+                                  get_aircraft_pilot_rankings_url)
 from .bullets_types import render_ammo_breakdown
 from .ammo_file_manager import download_breakdown_csv
 
@@ -316,6 +317,28 @@ def download_ammo_breakdown_csv(request, ammo_key, breakdown_type, bucket_id):
 
     return download_breakdown_csv(bucket, ammo_key, breakdown_type)
 
+
+def background_jobs_status(request):
+    """
+    Progress and throughput of the background jobs as JSON, e.g. for a monitoring scraper. Only answered for staff.
+    """
+    if not request.user.is_staff:
+        raise PermissionDenied
+
+    return JsonResponse({'jobs': [{
+        'job': state.job,
+        'sorties_left': state.sorties_left,
+        'batches': state.batches,
+        'sorties_processed': state.sorties_processed,
+        'wall_seconds': state.wall_seconds,
+        'db_seconds': state.db_seconds,
+        'sorties_per_second': state.sorties_per_second(),
+        'last_sorties_per_second': state.last_sorties_per_second,
+        'eta_seconds': state.eta_seconds(),
+        'last_batch_at': state.last_batch_at.isoformat() if state.last_batch_at else None,
+    } for state in AircraftBackgroundJobState.objects.all()]})
+
+
 def _get_player_aircraft_rating_position(bucket):
     if bucket.score == 0:
         return None, None